@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+'''
+    Critical-path report for traced loan requests.
+
+    Reads the span files the services write when TRACE_EXPORT_DIR is set (OTLP JSON lines, one file per service),
+    groups the spans of each loan request by their loan.request_id attribute and reconstructs the critical path:
+    starting from the span that finished last, it steps back to the span that was the last one still running (or
+    the last to finish) when the current one started. A step only counts up to the start of the next one, e.g.
+    process_results is still waiting for its publish confirmation when the aggregator already handles the event.
+    Time between two steps is reported as a wait before the next step (workflow dispatch, pub/sub delivery,
+    queueing). Spans running inside a step are expanded the same way, so a bank_quote step shows the time the bank
+    itself took. The step or wait with the largest share of the critical path is reported as the one that dominated
+    the request.
+
+    Examples:
+        python benchmarks/critical_path.py traces/ --request-id 42
+        python benchmarks/critical_path.py traces/ --slowest 20
+        python benchmarks/critical_path.py traces/loan-broker.jsonl traces/quote-aggregator.jsonl --json report.json
+'''
+
+REQUEST_ID_ATTRIBUTE = 'loan.request_id'
+WAIT = 'wait before'
+MAX_DEPTH = 4
+MIN_WAIT_MS = 0.1
+
+
+class SpanRecord:
+
+    def __init__(self, service: str, span: dict):
+        self.service = service
+        self.trace_id = span['traceId']
+        self.span_id = span['spanId']
+        self.parent_id = span.get('parentSpanId') or None
+        self.name = span['name']
+        self.start = int(span['startTimeUnixNano']) / 1e6
+        self.end = int(span['endTimeUnixNano']) / 1e6
+        self.attributes = {attribute['key']: next(iter(attribute['value'].values()))
+                           for attribute in span.get('attributes', [])}
+        self.error = span.get('status', {}).get('message') if span.get('status', {}).get('code') == 2 else None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def label(self) -> str:
+        bank = self.attributes.get('bank')
+        return '%s[%s]' % (self.name, bank) if bank else self.name
+
+
+def span_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.jsonl'))
+        else:
+            files.append(path)
+    return files
+
+
+def load_spans(paths: List[str]) -> Dict[str, SpanRecord]:
+    spans = {}
+    for path in span_files(paths):
+        with open(path, 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    document = json.loads(line)
+                except ValueError as err:
+                    # a service that was killed mid-write leaves a truncated last line
+                    print('Skipping %s:%d: %s' % (path, line_number, err), file=sys.stderr)
+                    continue
+                for resource_spans in document.get('resourceSpans', []):
+                    service = next((attribute['value'].get('stringValue') for attribute in
+                                    resource_spans.get('resource', {}).get('attributes', [])
+                                    if attribute['key'] == 'service.name'), os.path.basename(path))
+                    for scope_spans in resource_spans.get('scopeSpans', []):
+                        for span in scope_spans.get('spans', []):
+                            record = SpanRecord(service, span)
+                            spans[record.span_id] = record
+    return spans
+
+
+def group_by_request(spans: Dict[str, SpanRecord]) -> Dict[str, List[SpanRecord]]:
+    """Every span tagged with a request id, together with all spans below it."""
+    children = defaultdict(list)
+    for span in spans.values():
+        if span.parent_id:
+            children[span.parent_id].append(span)
+
+    requests = {}
+    for span in spans.values():
+        request_id = span.attributes.get(REQUEST_ID_ATTRIBUTE)
+        if request_id is None:
+            continue
+        group = requests.setdefault(str(request_id), {})
+        pending = [span]
+        while pending:
+            current = pending.pop()
+            if current.span_id not in group:
+                group[current.span_id] = current
+                pending.extend(children[current.span_id])
+    return {request_id: list(group.values()) for request_id, group in requests.items()}
+
+
+def nested_in(span: SpanRecord, parent: Optional[SpanRecord]) -> bool:
+    return parent is not None and span.start >= parent.start and span.end <= parent.end
+
+
+def fanned_out_together(span: SpanRecord, other: SpanRecord) -> bool:
+    return span.parent_id == other.parent_id and span.name == other.name
+
+
+def critical_path(spans: List[SpanRecord], by_id: Dict[str, SpanRecord], children: Dict[str, List[SpanRecord]],
+                  depth: int = 0) -> List[dict]:
+    # steps are the spans not running inside their parent, a workflow activity outlives the request that started it
+    steps = [span for span in spans if not nested_in(span, by_id.get(span.parent_id))] if depth == 0 else spans
+    if not steps:
+        return []
+
+    path = [max(steps, key=lambda span: span.end)]
+    while True:
+        # calls of the same fan-out run side by side, one only waited for another if that one had finished
+        predecessors = [span for span in steps if span.start < path[-1].start and
+                        (span.end <= path[-1].start or not fanned_out_together(span, path[-1]))]
+        if not predecessors:
+            break
+        path.append(max(predecessors, key=lambda span: min(span.end, path[-1].start)))
+    path.reverse()
+
+    entries = []
+    for index, span in enumerate(path):
+        following = path[index + 1] if index + 1 < len(path) else None
+        inner = [child for child in children[span.span_id] if nested_in(child, span)]
+        entries.append({
+            'stage': span.label,
+            'service': span.service,
+            'start': span.start,
+            'duration': span.duration,
+            'critical': min(span.end, following.start) - span.start if following else span.duration,
+            'error': span.error,
+            'path': critical_path(inner, by_id, children, depth + 1) if inner and depth < MAX_DEPTH else []
+        })
+        if following is not None and following.start - span.end >= MIN_WAIT_MS:
+            entries.append({'stage': '%s %s' % (WAIT, following.label), 'service': '', 'start': span.end, 'duration': following.start - span.end,
+                            'critical': following.start - span.end, 'path': []})
+    return entries
+
+
+def request_report(request_id: str, spans: List[SpanRecord]) -> dict:
+    by_id = {span.span_id: span for span in spans}
+    children = defaultdict(list)
+    for span in spans:
+        if span.parent_id:
+            children[span.parent_id].append(span)
+
+    path = critical_path(spans, by_id, children)
+    started = min(span.start for span in spans)
+    total = max(span.end for span in spans) - started
+
+    def relative(entries: List[dict]):
+        for entry in entries:
+            entry['start'] = entry['start'] - started
+            relative(entry['path'])
+
+    relative(path)
+    dominant = max(path, key=lambda entry: entry['critical'])
+    return {
+        'request_id': request_id,
+        'trace_id': spans[0].trace_id,
+        'end_to_end_ms': total,
+        'dominant': {'stage': dominant['stage'], 'service': dominant['service'], 'critical_ms': dominant['critical'],
+                     'share': dominant['critical'] / total if total else 0.0},
+        'critical_path': path
+    }
+
+
+def print_path(entries: List[dict], total: float, indent: int = 1):
+    for entry in entries:
+        print('%s%-*s %-18s %10.1f %10.1f %10.1f %5.0f%%%s' % (
+            '  ' * indent, 44 - 2 * indent, entry['stage'], entry['service'], entry['start'], entry['duration'],
+            entry['critical'], 100.0 * entry['critical'] / total if total else 0.0,
+            '  error: %s' % entry['error'] if entry.get('error') else ''))
+        print_path(entry['path'], total, indent + 1)
+
+
+def print_report(report: dict):
+    print('request %s  trace %s  end-to-end %.1f ms' % (
+        report['request_id'], report['trace_id'], report['end_to_end_ms']))
+    print('  %-42s %-18s %10s %10s %10s %6s' % ('stage', 'service', 'start ms', 'took ms', 'critical', 'share'))
+    print_path(report['critical_path'], report['end_to_end_ms'])
+    dominant = report['dominant']
+    print('  dominated by %s%s: %.1f ms (%.0f%%)' % (
+        dominant['stage'], ' in %s' % dominant['service'] if dominant['service'] else '', dominant['critical_ms'],
+        100.0 * dominant['share']))
+    print()
+
+
+def print_summary(reports: List[dict]):
+    counts = defaultdict(lambda: [0, 0.0])
+    for report in reports:
+        counts[report['dominant']['stage']][0] += 1
+        counts[report['dominant']['stage']][1] += report['dominant']['critical_ms']
+
+    print('%d requests, dominating stage:' % len(reports))
+    for stage, (count, duration) in sorted(counts.items(), key=lambda item: -item[1][0]):
+        print('  %-44s %6d requests %10.1f ms mean' % (stage, count, duration / count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconstruct the critical path of traced loan requests.')
+    parser.add_argument('paths', nargs='+', help='span files or directories of span files (TRACE_EXPORT_DIR)')
+    parser.add_argument('--request-id', action='append', help='request id to report, repeatable')
+    parser.add_argument('--slowest', type=int, default=10, help='without --request-id, report the N slowest requests')
+    parser.add_argument('--json', help='also write the reports to this file')
+    args = parser.parse_args()
+
+    requests = group_by_request(load_spans(args.paths))
+    if not requests:
+        print('No spans with a %s attribute found' % REQUEST_ID_ATTRIBUTE, file=sys.stderr)
+        sys.exit(1)
+
+    if args.request_id:
+        missing = [request_id for request_id in args.request_id if request_id not in requests]
+        for request_id in missing:
+            print('No spans found for request %s' % request_id, file=sys.stderr)
+        reports = [request_report(request_id, requests[request_id])
+                   for request_id in args.request_id if request_id in requests]
+    else:
+        reports = sorted((request_report(request_id, spans) for request_id, spans in requests.items()),
+                         key=lambda report: -report['end_to_end_ms'])
+        print_summary(reports)
+        print()
+        reports = reports[:args.slowest]
+
+    for report in reports:
+        print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
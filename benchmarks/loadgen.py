@@ -0,0 +1,365 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+'''
+    Load generator and benchmark for the loan pipeline.
+
+    Generates LoanRequest mixes and drives them against the loan broker, either open-loop at a target rate
+    (--rps) or closed-loop with a fixed number of concurrent clients (--concurrency). Every request is followed
+    through the pipeline and timed per stage:
+
+        submit     - POST until the broker answered with the workflow instance id
+        workflow   - submit until GET /loan-request/{instance_id} reports a terminal status
+        aggregate  - submit until GET /quotes/{request_id} on the quote aggregator returns the saved aggregate
+        end_to_end - submit start until the aggregate is saved (or the last stage that was tracked)
+        start_lag  - open-loop only, how long after its scheduled send time a request was actually sent
+
+    Open-loop stages are timed from the scheduled send time, not from when a worker got to the request, so time
+    spent waiting for a free worker counts against the request instead of being left out (coordinated omission).
+    Requests sent more than --late-start-ms behind schedule are counted as late starts; many of them mean the
+    load generator itself was saturated and --max-workers or the machine limited the offered rate.
+
+    Results (throughput, p50/p95/p99 per stage, errors) are printed and written as JSON, and can be compared
+    against an earlier run with --compare.
+
+    Examples:
+        python benchmarks/loadgen.py --rps 50 --duration 60 --output run.json
+        python benchmarks/loadgen.py --mode bulk --batch-size 500 --concurrency 4 --requests 20000
+        python benchmarks/loadgen.py --mode bank --bank-url http://localhost:5003 --concurrency 64
+        python benchmarks/loadgen.py --mode bank --bank-url http://localhost:5007/banks/union-vault --rps 500
+'''
+
+TERMS = [12, 24, 36, 60, 120, 180, 240, 360]
+TERMINAL_STATUSES = {'COMPLETED', 'FAILED', 'TERMINATED'}
+
+
+def create_session(pool_size: int) -> requests.Session:
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class LoanRequestGenerator:
+
+    def __init__(self, run_id: str, invalid_ssn_ratio: float, amount_median: int, amount_sigma: float,
+                 score_mean: int, score_stddev: int, seed: int):
+        self.run_id = run_id
+        self.invalid_ssn_ratio = invalid_ssn_ratio
+        self.amount_mu = math.log(amount_median)
+        self.amount_sigma = amount_sigma
+        self.score_mean = score_mean
+        self.score_stddev = score_stddev
+        self.random = random.Random(seed)
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def ssn(self) -> str:
+        if self.random.random() < self.invalid_ssn_ratio:
+            return '%09d' % self.random.randint(0, 999999999)
+        return '%03d-%02d-%04d' % (self.random.randint(1, 899), self.random.randint(1, 99), self.random.randint(1, 9999))
+
+    def loan_request(self) -> dict:
+        with self.lock:
+            self.sequence += 1
+            return {
+                'id': '%s-%d' % (self.run_id, self.sequence),
+                'SSN': self.ssn(),
+                'amount': int(min(2000000, max(1000, self.random.lognormvariate(self.amount_mu, self.amount_sigma)))),
+                'term': self.random.choice(TERMS)
+            }
+
+    def bank_loan_request(self) -> dict:
+        loan_request = self.loan_request()
+        with self.lock:
+            score = int(min(900, max(300, self.random.gauss(self.score_mean, self.score_stddev))))
+        return {'amount': loan_request['amount'], 'term': loan_request['term'], 'credit': {'score': score}}
+
+
+class Recorder:
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.late_starts = 0
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def error(self, stage: str, reason: str):
+        with self.lock:
+            key = '%s: %s' % (stage, reason)
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def started_late(self):
+        with self.lock:
+            self.late_starts += 1
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'throughput_per_second': len(values) / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': sum(values) * 1000.0 / len(values) if values else 0.0,
+        'p50_ms': percentile(values, 0.50) * 1000.0,
+        'p95_ms': percentile(values, 0.95) * 1000.0,
+        'p99_ms': percentile(values, 0.99) * 1000.0,
+        'max_ms': values[-1] * 1000.0 if values else 0.0,
+    }
+
+
+class Pipeline:
+
+    def __init__(self, args, session: requests.Session, generator: LoanRequestGenerator, recorder: Recorder):
+        self.args = args
+        self.session = session
+        self.generator = generator
+        self.recorder = recorder
+
+    def wait_for(self, url: str, stage: str, started: float, done) -> bool:
+        deadline = started + self.args.track_timeout
+        while time.monotonic() < deadline:
+            try:
+                response = self.session.get(url, timeout=self.args.http_timeout)
+                if done(response):
+                    self.recorder.record(stage, time.monotonic() - started)
+                    return True
+            except requests.RequestException as err:
+                self.recorder.error(stage, type(err).__name__)
+                return False
+            time.sleep(self.args.poll_interval)
+        self.recorder.error(stage, 'timeout')
+        return False
+
+    def track(self, loan_request_id: str, instance_id: str, started: float):
+        finished = started
+        if self.args.track_workflow and instance_id:
+            def workflow_done(response):
+                return response.ok and response.json().get('runtime_status') in TERMINAL_STATUSES
+            if not self.wait_for('%s/loan-request/%s' % (self.args.broker_url, instance_id), 'workflow', started, workflow_done):
+                return
+            finished = time.monotonic()
+
+        if self.args.track_aggregate:
+            if not self.wait_for('%s/quotes/%s' % (self.args.aggregator_url, loan_request_id), 'aggregate', started,
+                                 lambda response: response.status_code == 200):
+                return
+            finished = time.monotonic()
+
+        self.recorder.record('end_to_end', finished - started)
+
+    def run_single(self, scheduled: Optional[float] = None):
+        loan_request = self.generator.loan_request()
+        started = time.monotonic() if scheduled is None else scheduled
+        try:
+            response = self.session.post('%s/loan-request' % self.args.broker_url, json=loan_request,
+                                         timeout=self.args.http_timeout)
+        except requests.RequestException as err:
+            self.recorder.error('submit', type(err).__name__)
+            return
+        if not response.ok:
+            self.recorder.error('submit', 'HTTP %d' % response.status_code)
+            return
+        self.recorder.record('submit', time.monotonic() - started)
+        self.track(loan_request['id'], response.json().get('instance_id'), started)
+
+    def run_bulk(self, scheduled: Optional[float] = None):
+        loan_requests = [self.generator.loan_request() for _ in range(self.args.batch_size)]
+        body = '\n'.join(json.dumps(loan_request) for loan_request in loan_requests)
+        started = time.monotonic() if scheduled is None else scheduled
+        try:
+            response = self.session.post('%s/loan-requests' % self.args.broker_url, data=body,
+                                         headers={'content-type': 'application/x-ndjson'},
+                                         timeout=self.args.http_timeout)
+        except requests.RequestException as err:
+            self.recorder.error('submit_batch', type(err).__name__)
+            return
+        if not response.ok:
+            self.recorder.error('submit_batch', 'HTTP %d' % response.status_code)
+            return
+        self.recorder.record('submit_batch', time.monotonic() - started)
+
+        submitted = time.monotonic() - started
+        with ThreadPoolExecutor(max_workers=self.args.track_workers) as executor:
+            for loan_request, result in zip(loan_requests, response.json()['results']):
+                if 'instance_id' not in result:
+                    self.recorder.error('submit', 'rejected')
+                    continue
+                self.recorder.record('submit', submitted)
+                if self.args.track_workflow or self.args.track_aggregate:
+                    executor.submit(self.track, loan_request['id'], result['instance_id'], started)
+
+    def run_bank(self, scheduled: Optional[float] = None):
+        started = time.monotonic() if scheduled is None else scheduled
+        try:
+            response = self.session.post('%s/loan-quote' % self.args.bank_url, json=self.generator.bank_loan_request(),
+                                         timeout=self.args.http_timeout)
+        except requests.RequestException as err:
+            self.recorder.error('quote', type(err).__name__)
+            return
+        if not response.ok:
+            self.recorder.error('quote', 'HTTP %d' % response.status_code)
+            return
+        self.recorder.record('quote', time.monotonic() - started)
+
+    def run_one(self, scheduled: Optional[float] = None):
+        # open-loop requests are timed from their scheduled send time, closed-loop ones from now
+        if scheduled is not None:
+            lag = time.monotonic() - scheduled
+            self.recorder.record('start_lag', lag)
+            if lag * 1000.0 > self.args.late_start_ms:
+                self.recorder.started_late()
+        {'single': self.run_single, 'bulk': self.run_bulk, 'bank': self.run_bank}[self.args.mode](scheduled)
+
+
+def run_closed_loop(pipeline: Pipeline, args):
+    # every client sends its next request as soon as the previous one was fully tracked
+    stop_at = time.monotonic() + args.duration
+    remaining = [args.requests]
+    lock = threading.Lock()
+
+    def client():
+        while time.monotonic() < stop_at:
+            with lock:
+                if args.requests and remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            pipeline.run_one()
+
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open_loop(pipeline: Pipeline, args):
+    # requests are started on a fixed schedule whether or not earlier ones finished, and timed from that schedule
+    interval = 1.0 / args.rps
+    total = args.requests or int(args.rps * args.duration)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        for index in range(total):
+            delay = started + index * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(pipeline.run_one, started + index * interval)
+
+
+def compare(report: dict, baseline: dict):
+    print('\nCompared with %s:' % baseline.get('run_id'))
+    for stage, summary in report['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if not previous:
+            continue
+        for metric in ('throughput_per_second', 'p50_ms', 'p95_ms', 'p99_ms'):
+            before, after = previous[metric], summary[metric]
+            change = (after - before) * 100.0 / before if before else 0.0
+            print('  %-12s %-22s %10.2f -> %10.2f (%+.1f%%)' % (stage, metric, before, after, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the loan pipeline end to end.")
+    parser.add_argument('--mode', choices=['single', 'bulk', 'bank'], default='single',
+                        help="single: POST /loan-request, bulk: POST /loan-requests, bank: POST /loan-quote on a bank.")
+    parser.add_argument('--broker-url', default=os.getenv('LOAN_BROKER_URL', 'http://localhost:5006'))
+    parser.add_argument('--aggregator-url', default=os.getenv('QUOTE_AGGREGATOR_URL', 'http://localhost:5002'))
+    parser.add_argument('--bank-url', default=os.getenv('BANK_URL', 'http://localhost:5003'))
+    parser.add_argument('--rps', type=float, default=0, help="Open-loop target rate, 0 runs closed-loop.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Closed-loop concurrent clients.")
+    parser.add_argument('--max-workers', type=int, default=256, help="Open-loop worker threads.")
+    parser.add_argument('--late-start-ms', type=float, default=10,
+                        help="Open-loop requests sent later than this behind schedule count as late starts.")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to generate load for.")
+    parser.add_argument('--requests', type=int, default=0, help="Stop after this many submissions, 0 for no limit.")
+    parser.add_argument('--batch-size', type=int, default=100, help="Loan requests per bulk submission.")
+    parser.add_argument('--invalid-ssn-ratio', type=float, default=0.05)
+    parser.add_argument('--amount-median', type=int, default=250000)
+    parser.add_argument('--amount-sigma', type=float, default=0.8)
+    parser.add_argument('--score-mean', type=int, default=650, help="Credit score mix for --mode bank.")
+    parser.add_argument('--score-stddev', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-track-workflow', dest='track_workflow', action='store_false')
+    parser.add_argument('--no-track-aggregate', dest='track_aggregate', action='store_false')
+    parser.add_argument('--track-timeout', type=float, default=60)
+    parser.add_argument('--track-workers', type=int, default=32, help="Threads following the items of one bulk submission.")
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--http-timeout', type=float, default=30)
+    parser.add_argument('--output', help="Write the JSON report to this file.")
+    parser.add_argument('--compare', help="An earlier JSON report to compare against.")
+    args = parser.parse_args()
+
+    if args.mode == 'bank':
+        args.track_workflow = args.track_aggregate = False
+
+    run_id = 'bench-%s' % uuid.uuid4().hex[:8]
+    session = create_session(max(args.concurrency, args.max_workers))
+    generator = LoanRequestGenerator(run_id, args.invalid_ssn_ratio, args.amount_median, args.amount_sigma,
+                                     args.score_mean, args.score_stddev, args.seed)
+    recorder = Recorder()
+    pipeline = Pipeline(args, session, generator, recorder)
+
+    print('Running %s in %s mode (%s)...' % (run_id, args.mode,
+                                             '%.1f rps' % args.rps if args.rps else '%d clients' % args.concurrency))
+    started = time.monotonic()
+    if args.rps > 0:
+        run_open_loop(pipeline, args)
+    else:
+        run_closed_loop(pipeline, args)
+    elapsed = time.monotonic() - started
+
+    report = {
+        'run_id': run_id,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - elapsed)),
+        'elapsed_seconds': elapsed,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'stages': {stage: summarize(samples, elapsed) for stage, samples in recorder.samples.items()},
+        'errors': recorder.errors,
+        'late_starts': recorder.late_starts,
+    }
+
+    for stage, summary in report['stages'].items():
+        print('  %-12s n=%-7d %8.1f/s  p50=%8.1fms  p95=%8.1fms  p99=%8.1fms' % (
+            stage, summary['count'], summary['throughput_per_second'],
+            summary['p50_ms'], summary['p95_ms'], summary['p99_ms']))
+    if args.rps > 0 and recorder.late_starts:
+        print('  %d requests started more than %.0fms behind schedule, the load generator was saturated' % (
+            recorder.late_starts, args.late_start_ms), file=sys.stderr)
+    for reason, count in recorder.errors.items():
+        print('  error %s x%d' % (reason, count), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print('Report written to %s' % args.output)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare(report, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
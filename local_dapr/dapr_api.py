@@ -0,0 +1,122 @@
+import logging
+import threading
+
+import grpc
+from dapr.proto import api_service_v1, api_v1
+from google.protobuf import empty_pb2
+
+from pubsub import PubSubBroker
+from state_store import EtagMismatch, StateStore
+
+'''
+    The subset of the Dapr gRPC API the services use: publishing single and bulk events, streaming subscriptions,
+    and saving, reading and deleting state, one key or many at a time. Every other call answers UNIMPLEMENTED.
+'''
+
+
+def ttl_seconds(metadata) -> float:
+    try:
+        return float(metadata.get('ttlInSeconds', 0))
+    except ValueError:
+        return 0
+
+
+class DaprApi(api_service_v1.DaprServicer):
+
+    def __init__(self, state_store: StateStore, broker: PubSubBroker):
+        self.state_store = state_store
+        self.broker = broker
+
+    # region Pub/sub
+
+    def PublishEvent(self, request, context):
+        self.broker.publish(request.pubsub_name, request.topic, request.data, request.data_content_type,
+                            dict(request.metadata))
+        return empty_pb2.Empty()
+
+    def BulkPublishEvent(self, request, context):
+        for entry in request.entries:
+            self.broker.publish(request.pubsub_name, request.topic, entry.event, entry.content_type,
+                                {**request.metadata, **entry.metadata})
+        return api_v1.BulkPublishResponse()
+
+    def BulkPublishEventAlpha1(self, request, context):
+        return self.BulkPublishEvent(request, context)
+
+    def SubscribeTopicEventsAlpha1(self, request_iterator, context):
+        initial = next(request_iterator, None)
+        if initial is None or not initial.HasField('initial_request'):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'the first message must be an initial request')
+        initial = initial.initial_request
+        subscriber = self.broker.subscribe(initial.pubsub_name, initial.topic, initial.dead_letter_topic)
+        context.add_callback(subscriber.close)
+
+        def read_responses():
+            try:
+                for message in request_iterator:
+                    if message.HasField('event_processed'):
+                        subscriber.respond(message.event_processed.id, message.event_processed.status.status)
+            except grpc.RpcError:
+                pass
+            finally:
+                subscriber.close()
+
+        threading.Thread(target=read_responses, name='subscription-responses', daemon=True).start()
+
+        yield api_v1.SubscribeTopicEventsResponseAlpha1(
+            initial_response=api_v1.SubscribeTopicEventsResponseInitialAlpha1())
+        try:
+            while context.is_active() and not subscriber.closed:
+                event = subscriber.next_event(timeout=0.5)
+                if event is not None:
+                    yield api_v1.SubscribeTopicEventsResponseAlpha1(event_message=event)
+        finally:
+            subscriber.close()
+            logging.info('Subscription closed on %s/%s', initial.pubsub_name, initial.topic)
+
+    # endregion
+
+    # region State
+
+    def SaveState(self, request, context):
+        items = [(item.key, item.value, item.etag.value if item.HasField('etag') else None, ttl_seconds(item.metadata))
+                 for item in request.states]
+        try:
+            self.state_store.save(request.store_name, items)
+        except EtagMismatch as err:
+            context.abort(grpc.StatusCode.ABORTED, str(err))
+        return empty_pb2.Empty()
+
+    def GetState(self, request, context):
+        entry = self.state_store.get(request.store_name, request.key)
+        if entry is None:
+            return api_v1.GetStateResponse()
+        return api_v1.GetStateResponse(data=entry[0], etag=entry[1])
+
+    def GetBulkState(self, request, context):
+        items = []
+        for key, entry in self.state_store.get_bulk(request.store_name, list(request.keys)):
+            if entry is None:
+                items.append(api_v1.BulkStateItem(key=key))
+            else:
+                items.append(api_v1.BulkStateItem(key=key, data=entry[0], etag=entry[1]))
+        return api_v1.GetBulkStateResponse(items=items)
+
+    def DeleteState(self, request, context):
+        try:
+            self.state_store.delete(request.store_name,
+                                    [(request.key, request.etag.value if request.HasField('etag') else None)])
+        except EtagMismatch as err:
+            context.abort(grpc.StatusCode.ABORTED, str(err))
+        return empty_pb2.Empty()
+
+    def DeleteBulkState(self, request, context):
+        try:
+            self.state_store.delete(request.store_name,
+                                    [(item.key, item.etag.value if item.HasField('etag') else None)
+                                     for item in request.states])
+        except EtagMismatch as err:
+            context.abort(grpc.StatusCode.ABORTED, str(err))
+        return empty_pb2.Empty()
+
+    # endregion
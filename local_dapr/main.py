@@ -0,0 +1,219 @@
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+from concurrent import futures
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+import dapr.ext.workflow._durabletask.internal.orchestrator_service_pb2_grpc as workflow_stubs
+import grpc
+import httpx
+import uvicorn
+import yaml
+from dapr.proto import api_service_v1
+from fastapi import FastAPI, HTTPException, Request, Response
+from starlette.requests import ClientDisconnect
+
+from dapr_api import DaprApi
+from pubsub import PubSubBroker
+from state_store import StateStore
+from workflow_backend import WorkflowBackend
+
+'''
+    Local stand-in for the Catalyst sidecar, so the whole pipeline runs on one machine without network access.
+
+        python local_dapr/main.py --config dev-loan-broker.yaml
+
+    starts the emulator and every app of the dev config with DAPR_HTTP_ENDPOINT and DAPR_GRPC_ENDPOINT pointing at it.
+    Use --apps to start only some of them, or --no-apps to start the emulator alone and run the services yourself
+    with DAPR_HTTP_ENDPOINT=http://127.0.0.1:3500 and DAPR_GRPC_ENDPOINT=127.0.0.1:50001.
+
+    The HTTP port routes service invocation to the app named by the dapr-app-id header (or /v1.0/invoke/<app-id>/method/)
+    and answers the SDK health checks. The gRPC port serves pub/sub, state and the workflow engine, see dapr_api.py
+    and workflow_backend.py. GET /local-dapr/stats on the HTTP port reports the emulator counters.
+
+    LOCAL_DAPR_GRPC_WORKERS - gRPC server threads, every open subscription or workflow worker stream holds one.
+    LOCAL_DAPR_HTTP_POOL_SIZE - connections kept per app for forwarded invocations.
+'''
+
+local_dapr_grpc_workers = int(os.getenv('LOCAL_DAPR_GRPC_WORKERS', '64'))
+local_dapr_http_pool_size = int(os.getenv('LOCAL_DAPR_HTTP_POOL_SIZE', '100'))
+
+# headers that describe a single hop and must not be forwarded
+hop_by_hop_headers = {'connection', 'keep-alive', 'transfer-encoding', 'upgrade', 'te', 'trailer',
+                      'proxy-authorization', 'proxy-authenticate', 'host', 'content-length', 'content-encoding'}
+
+http_methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS']
+
+logging.basicConfig(level=logging.INFO)
+
+state_store = StateStore()
+broker = PubSubBroker()
+workflow_backend = WorkflowBackend()
+
+
+def load_apps(config_file: str) -> List[dict]:
+    with open(config_file, 'r') as file:
+        config_data = yaml.safe_load(file)
+
+    apps = []
+    for app in config_data['apps']:
+        command = [str(part) for part in app.get('command', [])]
+        port = int(app.get('appPort') or 0)
+        if not port and '--port' in command:
+            # the loan broker has no app port in the dev config but still serves HTTP
+            port = int(command[command.index('--port') + 1])
+        apps.append({
+            'app_id': app['appId'],
+            'port': port,
+            'work_dir': os.path.join(os.path.dirname(os.path.abspath(config_file)), app.get('workDir', '.')),
+            'command': command,
+            'env': {key: str(value) for key, value in (app.get('env') or {}).items()}
+        })
+    return apps
+
+
+def launch_app(app: dict, http_port: int, grpc_port: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update(app['env'])
+    env.pop('DAPR_API_TOKEN', None)
+    env['DAPR_APP_ID'] = app['app_id']
+    env['DAPR_HTTP_ENDPOINT'] = 'http://127.0.0.1:%d' % http_port
+    env['DAPR_GRPC_ENDPOINT'] = '127.0.0.1:%d' % grpc_port
+
+    # run the app with the interpreter of the emulator, so both share the same environment
+    command = app['command']
+    if command and command[0] in ('uvicorn', 'python', 'python3'):
+        command = [sys.executable] + (['-m', 'uvicorn'] if command[0] == 'uvicorn' else []) + command[1:]
+
+    logging.info('Starting %s: %s', app['app_id'], ' '.join(command))
+    return subprocess.Popen(command, cwd=app['work_dir'], env=env)
+
+
+def stop_apps(processes: Dict[str, subprocess.Popen]):
+    for process in processes.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    for app_id, process in processes.items():
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            logging.warning('%s did not stop in time, killing it', app_id)
+            process.kill()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    args = app.state.args
+
+    state_store.start()
+    workflow_backend.start()
+
+    grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=local_dapr_grpc_workers))
+    api_service_v1.add_DaprServicer_to_server(DaprApi(state_store, broker), grpc_server)
+    workflow_stubs.add_TaskHubSidecarServiceServicer_to_server(workflow_backend, grpc_server)
+    grpc_server.add_insecure_port('127.0.0.1:%d' % args.grpc_port)
+    grpc_server.start()
+    logging.info('Dapr gRPC API listening on 127.0.0.1:%d', args.grpc_port)
+
+    app.state.http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=local_dapr_http_pool_size * max(len(app.state.app_ports), 1),
+                            max_keepalive_connections=local_dapr_http_pool_size),
+        timeout=httpx.Timeout(60.0))
+
+    processes = {app_def['app_id']: launch_app(app_def, args.http_port, args.grpc_port)
+                 for app_def in app.state.launched_apps}
+    yield
+
+    stop_apps(processes)
+    await app.state.http_client.aclose()
+    grpc_server.stop(grace=5).wait()
+    workflow_backend.close()
+    state_store.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get('/v1.0/healthz')
+@app.get('/v1.0/healthz/outbound')
+def healthz():
+    return Response(status_code=204)
+
+
+@app.get('/local-dapr/stats')
+def stats():
+    return {
+        'state': state_store.stats(),
+        'pubsub': broker.stats(),
+        'workflows': workflow_backend.stats()
+    }
+
+
+@app.api_route('/v1.0/invoke/{app_id}/method/{path:path}', methods=http_methods)
+async def invoke(app_id: str, path: str, request: Request):
+    return await forward(app_id, path, request)
+
+
+@app.api_route('/{path:path}', methods=http_methods)
+async def invoke_by_header(path: str, request: Request):
+    app_id = request.headers.get('dapr-app-id')
+    if not app_id:
+        raise HTTPException(status_code=404, detail='No dapr-app-id header on request to /%s' % path)
+    return await forward(app_id, path, request)
+
+
+async def forward(app_id: str, path: str, request: Request) -> Response:
+    port = app.state.app_ports.get(app_id)
+    if port is None:
+        raise HTTPException(status_code=404, detail='Unknown app id %s' % app_id)
+
+    headers = {key: value for key, value in request.headers.items() if key.lower() not in hop_by_hop_headers}
+    try:
+        body = await request.body()
+    except ClientDisconnect:
+        # the caller gave up, e.g. the losing attempt of a hedged request was cancelled
+        return Response(status_code=499)
+
+    try:
+        response = await app.state.http_client.request(
+            request.method,
+            'http://127.0.0.1:%d/%s' % (port, path),
+            params=request.query_params,
+            content=body,
+            headers=headers)
+    except httpx.HTTPError as err:
+        logging.error('Invocation of %s /%s failed: %s', app_id, path, err)
+        raise HTTPException(status_code=502, detail='Invocation of %s failed: %s' % (app_id, err))
+
+    return Response(content=response.content,
+                    status_code=response.status_code,
+                    headers={key: value for key, value in response.headers.items()
+                             if key.lower() not in hop_by_hop_headers})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the loan broker services against a local Dapr stand-in.')
+    parser.add_argument('--config', default='dev-loan-broker.yaml',
+                        help='dev config listing the apps, their ports and commands')
+    parser.add_argument('--http-port', type=int, default=3500, help='port for service invocation and health checks')
+    parser.add_argument('--grpc-port', type=int, default=50001, help='port for the Dapr gRPC and workflow APIs')
+    parser.add_argument('--apps', help='comma separated app ids to start, all apps of the config by default')
+    parser.add_argument('--no-apps', action='store_true', help='start only the emulator')
+    args = parser.parse_args()
+
+    apps = load_apps(args.config)
+    selected = set(args.apps.split(',')) if args.apps else {app_def['app_id'] for app_def in apps}
+
+    app.state.args = args
+    app.state.app_ports = {app_def['app_id']: app_def['port'] for app_def in apps if app_def['port']}
+    app.state.launched_apps = [] if args.no_apps else [app_def for app_def in apps if app_def['app_id'] in selected]
+
+    uvicorn.run(app, host='127.0.0.1', port=args.http_port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from dapr.proto import appcallback_v1
+from google.protobuf import struct_pb2
+
+'''
+    In-memory pub/sub standing in for the managed aws-pubsub component. Events are kept per pubsub/topic in a FIFO
+    queue until a streaming subscription takes them, so nothing is lost when the subscriber starts late. All
+    subscriptions on a topic compete for its events, like the replicas of one app on an SQS queue.
+
+    An event stays in flight until the subscriber answers. SUCCESS removes it, RETRY delivers it again after a
+    backoff, DROP moves it to the dead letter topic of the subscription. An event that was retried
+    PUBSUB_MAX_DELIVERY_ATTEMPTS times is dead-lettered as well. Events still in flight when a stream closes are
+    put back at the head of the queue, so delivery is at-least-once.
+
+    Like Dapr, publish metadata cloudevent.type overrides the type of the CloudEvent and cloudevent.traceparent
+    (or cloudevent.tracestate) is delivered as an extension of it.
+
+    PUBSUB_MAX_IN_FLIGHT - the number of unanswered events a subscription holds before delivery to it pauses.
+    PUBSUB_MAX_DELIVERY_ATTEMPTS - deliveries of an event before it is dead-lettered.
+    PUBSUB_RETRY_BACKOFF_MS - delay before a retried event is delivered again, multiplied by the attempt number.
+'''
+
+pubsub_max_in_flight = int(os.getenv('PUBSUB_MAX_IN_FLIGHT', '1000'))
+pubsub_max_delivery_attempts = int(os.getenv('PUBSUB_MAX_DELIVERY_ATTEMPTS', '5'))
+pubsub_retry_backoff_ms = float(os.getenv('PUBSUB_RETRY_BACKOFF_MS', '100'))
+
+SUCCESS = appcallback_v1.TopicEventResponse.SUCCESS
+RETRY = appcallback_v1.TopicEventResponse.RETRY
+DROP = appcallback_v1.TopicEventResponse.DROP
+
+
+class Subscriber:
+
+    def __init__(self, broker: 'PubSubBroker', pubsub_name: str, topic: str, dead_letter_topic: str):
+        self.broker = broker
+        self.pubsub_name = pubsub_name
+        self.topic = topic
+        self.dead_letter_topic = dead_letter_topic
+        self.in_flight: Dict[str, Tuple[appcallback_v1.TopicEventRequest, int]] = {}  # id -> (event, attempts)
+        self.closed = False
+
+    def next_event(self, timeout: float) -> Optional[appcallback_v1.TopicEventRequest]:
+        return self.broker._take(self, timeout)
+
+    def respond(self, event_id: str, status: int):
+        self.broker._respond(self, event_id, status)
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+
+class PubSubBroker:
+
+    def __init__(self, max_in_flight: int = pubsub_max_in_flight,
+                 max_delivery_attempts: int = pubsub_max_delivery_attempts,
+                 retry_backoff_ms: float = pubsub_retry_backoff_ms):
+        self.max_in_flight = max_in_flight
+        self.max_delivery_attempts = max_delivery_attempts
+        self.retry_backoff_seconds = retry_backoff_ms / 1000.0
+        self.published = 0
+        self.delivered = 0
+        self.acknowledged = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self._topics: Dict[Tuple[str, str], deque] = {}  # (pubsub, topic) -> deque of (event, attempts)
+        self._subscribers: Dict[Tuple[str, str], list] = {}
+        self._condition = threading.Condition()
+
+    def publish(self, pubsub_name: str, topic: str, data: bytes, content_type: str,
+                metadata: Optional[Dict[str, str]] = None) -> str:
+        metadata = metadata or {}
+        extensions = struct_pb2.Struct()
+        for name in ('traceparent', 'tracestate'):
+            if metadata.get('cloudevent.' + name):
+                extensions[name] = metadata['cloudevent.' + name]
+        event = appcallback_v1.TopicEventRequest(
+            id=str(uuid.uuid4()),
+            source='local-dapr',
+            type=metadata.get('cloudevent.type') or 'com.dapr.event.sent',
+            extensions=extensions,
+            spec_version='1.0',
+            data_content_type=content_type or 'application/json',
+            data=data,
+            topic=topic,
+            pubsub_name=pubsub_name)
+        with self._condition:
+            self._topics.setdefault((pubsub_name, topic), deque()).append((event, 0))
+            self.published += 1
+            self._condition.notify_all()
+        return event.id
+
+    def subscribe(self, pubsub_name: str, topic: str, dead_letter_topic: str = '') -> Subscriber:
+        subscriber = Subscriber(self, pubsub_name, topic, dead_letter_topic)
+        with self._condition:
+            self._subscribers.setdefault((pubsub_name, topic), []).append(subscriber)
+        logging.info('Subscription opened on %s/%s', pubsub_name, topic)
+        return subscriber
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'topics': {'%s/%s' % key: {
+                    'pending': len(events),
+                    'subscribers': len(self._subscribers.get(key, [])),
+                    'in_flight': sum(len(subscriber.in_flight) for subscriber in self._subscribers.get(key, []))
+                } for key, events in self._topics.items()},
+                'published': self.published,
+                'delivered': self.delivered,
+                'acknowledged': self.acknowledged,
+                'retried': self.retried,
+                'dead_lettered': self.dead_lettered
+            }
+
+    def _take(self, subscriber: Subscriber, timeout: float) -> Optional[appcallback_v1.TopicEventRequest]:
+        key = (subscriber.pubsub_name, subscriber.topic)
+        with self._condition:
+            events = self._topics.setdefault(key, deque())
+            if not self._condition.wait_for(
+                    lambda: subscriber.closed or (events and len(subscriber.in_flight) < self.max_in_flight),
+                    timeout):
+                return None
+            if subscriber.closed:
+                return None
+            event, attempts = events.popleft()
+            subscriber.in_flight[event.id] = (event, attempts + 1)
+            self.delivered += 1
+            return event
+
+    def _respond(self, subscriber: Subscriber, event_id: str, status: int):
+        with self._condition:
+            entry = subscriber.in_flight.pop(event_id, None)
+            if entry is None:
+                return
+            self._condition.notify_all()
+            if status == SUCCESS:
+                self.acknowledged += 1
+                return
+
+        event, attempts = entry
+        if status == RETRY and attempts < self.max_delivery_attempts:
+            with self._condition:
+                self.retried += 1
+            timer = threading.Timer(self.retry_backoff_seconds * attempts, self._requeue,
+                                    args=((subscriber.pubsub_name, subscriber.topic), [(event, attempts)]))
+            timer.daemon = True
+            timer.start()
+            return
+
+        self._dead_letter(subscriber, event)
+
+    def _dead_letter(self, subscriber: Subscriber, event: appcallback_v1.TopicEventRequest):
+        with self._condition:
+            self.dead_lettered += 1
+        if subscriber.dead_letter_topic:
+            logging.warning('Moving event %s from %s to dead letter topic %s',
+                            event.id, subscriber.topic, subscriber.dead_letter_topic)
+            metadata = {'cloudevent.' + name: value for name, value in event.extensions.items()}
+            metadata['cloudevent.type'] = event.type
+            self.publish(subscriber.pubsub_name, subscriber.dead_letter_topic, event.data, event.data_content_type,
+                         metadata)
+        else:
+            logging.warning('Discarding event %s from %s, the subscription has no dead letter topic',
+                            event.id, subscriber.topic)
+
+    def _requeue(self, key: Tuple[str, str], entries: list):
+        with self._condition:
+            self._topics.setdefault(key, deque()).extendleft(reversed(entries))
+            self._condition.notify_all()
+
+    def _unsubscribe(self, subscriber: Subscriber):
+        key = (subscriber.pubsub_name, subscriber.topic)
+        with self._condition:
+            subscriber.closed = True
+            if subscriber in self._subscribers.get(key, []):
+                self._subscribers[key].remove(subscriber)
+            in_flight = list(subscriber.in_flight.values())
+            subscriber.in_flight.clear()
+            self._condition.notify_all()
+        if in_flight:
+            logging.info('Requeueing %d unanswered events of a closed subscription on %s/%s', len(in_flight), *key)
+            self._requeue(key, in_flight)
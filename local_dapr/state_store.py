@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+'''
+    In-memory state store standing in for the managed kvstore. Every component name gets its own key space, so
+    any store_name the services use works without configuration. Values are kept as the bytes that were saved.
+
+    Items saved with a ttlInSeconds metadata entry expire after that many seconds. Expired items are dropped when
+    they are read and by a periodic sweep every STATE_TTL_SWEEP_SECONDS.
+
+    Saves and deletes that carry an etag only succeed when it matches the stored one, like first-write concurrency
+    in Dapr. Etags are increasing integers rendered as strings.
+'''
+
+state_ttl_sweep_seconds = float(os.getenv('STATE_TTL_SWEEP_SECONDS', '5'))
+
+
+class EtagMismatch(Exception):
+    pass
+
+
+class StateStore:
+
+    def __init__(self, sweep_seconds: float = state_ttl_sweep_seconds):
+        self.sweep_seconds = sweep_seconds
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.expired = 0
+        self._stores: Dict[str, Dict[str, Tuple[bytes, str, Optional[float]]]] = {}  # key -> (value, etag, expires_at)
+        self._version = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sweep, name='state-ttl-sweep', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+
+    def get(self, store_name: str, key: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            self.reads += 1
+            return self._read(store_name, key, time.monotonic())
+
+    def get_bulk(self, store_name: str, keys: List[str]) -> List[Tuple[str, Optional[Tuple[bytes, str]]]]:
+        now = time.monotonic()
+        with self._lock:
+            self.reads += len(keys)
+            return [(key, self._read(store_name, key, now)) for key in keys]
+
+    def save(self, store_name: str, items: List[Tuple[str, bytes, Optional[str], Optional[float]]]):
+        """Saves (key, value, etag, ttl_seconds) items, all or nothing when an etag does not match."""
+        now = time.monotonic()
+        with self._lock:
+            store = self._stores.setdefault(store_name, {})
+            for key, _, etag, _ in items:
+                self._check_etag(store_name, key, etag, now)
+            for key, value, _, ttl_seconds in items:
+                self._version += 1
+                expires_at = now + ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+                store[key] = (value, str(self._version), expires_at)
+            self.writes += len(items)
+
+    def delete(self, store_name: str, items: List[Tuple[str, Optional[str]]]):
+        now = time.monotonic()
+        with self._lock:
+            store = self._stores.get(store_name, {})
+            for key, etag in items:
+                self._check_etag(store_name, key, etag, now)
+            for key, _ in items:
+                store.pop(key, None)
+            self.deletes += len(items)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'stores': {store_name: len(store) for store_name, store in self._stores.items()},
+                'reads': self.reads,
+                'writes': self.writes,
+                'deletes': self.deletes,
+                'expired': self.expired
+            }
+
+    def _read(self, store_name: str, key: str, now: float) -> Optional[Tuple[bytes, str]]:
+        store = self._stores.get(store_name)
+        entry = store.get(key) if store else None
+        if entry is None:
+            return None
+        value, etag, expires_at = entry
+        if expires_at is not None and expires_at <= now:
+            del store[key]
+            self.expired += 1
+            return None
+        return value, etag
+
+    def _check_etag(self, store_name: str, key: str, etag: Optional[str], now: float):
+        if not etag:
+            return
+        entry = self._read(store_name, key, now)
+        if entry is None or entry[1] != etag:
+            raise EtagMismatch('possible etag mismatch for key %s in store %s' % (key, store_name))
+
+    def _sweep(self):
+        while not self._stopped.wait(self.sweep_seconds):
+            now = time.monotonic()
+            with self._lock:
+                for store in self._stores.values():
+                    expired = [key for key, (_, _, expires_at) in store.items()
+                               if expires_at is not None and expires_at <= now]
+                    for key in expired:
+                        del store[key]
+                    self.expired += len(expired)
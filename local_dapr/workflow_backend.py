@@ -0,0 +1,446 @@
+import heapq
+import logging
+import os
+import queue
+import threading
+import uuid
+from datetime import timezone
+from typing import Dict, List, Optional
+
+import grpc
+import dapr.ext.workflow._durabletask.internal.orchestrator_service_pb2_grpc as stubs
+import dapr.ext.workflow._durabletask.internal.protos as pb
+from google.protobuf import empty_pb2, timestamp_pb2, wrappers_pb2
+
+'''
+    In-memory workflow backend standing in for the managed workflow engine. It serves the durabletask
+    TaskHubSidecarService that WorkflowRuntime and DaprWorkflowClient talk to, on the same gRPC port as the Dapr API.
+
+    Each workflow instance keeps its history. Every time something happens to it (start, activity result, timer,
+    raised event), the instance is handed to a worker as a WorkflowRequest with the past history and the new events,
+    and the actions the worker returns are recorded: activities are queued as work items, timers are armed and a
+    completion ends the instance. At most one workflow request per instance is outstanding, events arriving
+    meanwhile wait in its inbox.
+
+    Work items are shared by all connected workers. Items a worker received but did not complete before its stream
+    closed are queued again. Nothing is persisted, instances are lost when the process stops.
+
+    The protocol messages and service stubs come from the durabletask code bundled in dapr-ext-workflow, which is
+    private to the SDK; requirements.txt pins the release they were taken from.
+
+    WORKFLOW_STREAM_POLL_SECONDS - how often an idle work item stream checks whether the worker is still connected.
+'''
+
+workflow_stream_poll_seconds = float(os.getenv('WORKFLOW_STREAM_POLL_SECONDS', '0.5'))
+
+terminal_statuses = {
+    pb.ORCHESTRATION_STATUS_COMPLETED,
+    pb.ORCHESTRATION_STATUS_FAILED,
+    pb.ORCHESTRATION_STATUS_TERMINATED,
+    pb.ORCHESTRATION_STATUS_CANCELED,
+}
+
+
+def now_timestamp() -> timestamp_pb2.Timestamp:
+    timestamp = timestamp_pb2.Timestamp()
+    timestamp.GetCurrentTime()
+    return timestamp
+
+
+def optional_field(message, field: str):
+    return getattr(message, field) if message.HasField(field) else None
+
+
+class Instance:
+
+    def __init__(self, instance_id: str, name: str, input: Optional[wrappers_pb2.StringValue]):
+        self.instance_id = instance_id
+        self.name = name
+        self.input = input
+        self.execution_id = uuid.uuid4().hex
+        self.status = pb.ORCHESTRATION_STATUS_PENDING
+        self.created_at = now_timestamp()
+        self.last_updated_at = self.created_at
+        self.completed_at = None
+        self.output = None
+        self.custom_status = None
+        self.failure_details = None
+        self.history: List[pb.HistoryEvent] = []
+        self.inbox: List[pb.HistoryEvent] = []
+        self.dispatched: Optional[List[pb.HistoryEvent]] = None  # new events of the outstanding workflow request
+        self.token: Optional[str] = None
+
+    def is_terminal(self) -> bool:
+        return self.status in terminal_statuses
+
+    def execution_started(self) -> pb.HistoryEvent:
+        return pb.HistoryEvent(
+            eventId=-1,
+            timestamp=now_timestamp(),
+            executionStarted=pb.ExecutionStartedEvent(
+                name=self.name,
+                input=self.input,
+                workflowInstance=pb.WorkflowInstance(
+                    instanceId=self.instance_id,
+                    executionId=wrappers_pb2.StringValue(value=self.execution_id))))
+
+    def state(self, include_payloads: bool) -> pb.WorkflowState:
+        return pb.WorkflowState(
+            instanceId=self.instance_id,
+            name=self.name,
+            workflowStatus=self.status,
+            createdTimestamp=self.created_at,
+            lastUpdatedTimestamp=self.last_updated_at,
+            completedTimestamp=self.completed_at,
+            input=self.input if include_payloads else None,
+            output=self.output if include_payloads else None,
+            customStatus=self.custom_status,
+            failureDetails=self.failure_details,
+            executionId=wrappers_pb2.StringValue(value=self.execution_id))
+
+
+class WorkflowBackend(stubs.TaskHubSidecarServiceServicer):
+
+    def __init__(self, poll_seconds: float = workflow_stream_poll_seconds):
+        self.poll_seconds = poll_seconds
+        self.started = 0
+        self.workflow_items = 0
+        self.activity_items = 0
+        self.timers_fired = 0
+        self.redispatched = 0
+        self._instances: Dict[str, Instance] = {}
+        self._outstanding: Dict[str, pb.WorkItem] = {}  # completion token -> work item
+        self._work_items = queue.Queue()
+        self._timers = []  # heap of (fire_at, sequence, instance_id, execution_id, event)
+        self._timer_sequence = 0
+        self._lock = threading.Lock()
+        self._state_changed = threading.Condition(self._lock)
+        self._timers_changed = threading.Condition(self._lock)
+        self._stopped = False
+        self._timer_thread = threading.Thread(target=self._run_timers, name='workflow-timers', daemon=True)
+
+    def start(self):
+        self._timer_thread.start()
+
+    def close(self):
+        with self._lock:
+            self._stopped = True
+            self._timers_changed.notify_all()
+            self._state_changed.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = {}
+            for instance in self._instances.values():
+                status = pb.OrchestrationStatus.Name(instance.status).replace('ORCHESTRATION_STATUS_', '')
+                statuses[status] = statuses.get(status, 0) + 1
+            return {
+                'instances': statuses,
+                'queued_work_items': self._work_items.qsize(),
+                'outstanding_work_items': len(self._outstanding),
+                'armed_timers': len(self._timers),
+                'started': self.started,
+                'workflow_items': self.workflow_items,
+                'activity_items': self.activity_items,
+                'timers_fired': self.timers_fired,
+                'redispatched': self.redispatched
+            }
+
+    # region Client API
+
+    def Hello(self, request, context):
+        return empty_pb2.Empty()
+
+    def StartInstance(self, request, context):
+        instance_id = request.instanceId or uuid.uuid4().hex
+        with self._lock:
+            existing = self._instances.get(instance_id)
+            if existing is not None and not existing.is_terminal():
+                context.abort(grpc.StatusCode.ALREADY_EXISTS, 'workflow instance %s already exists' % instance_id)
+
+            instance = Instance(instance_id, request.name, optional_field(request, 'input'))
+            self._instances[instance_id] = instance
+            self.started += 1
+
+            started = instance.execution_started()
+            scheduled_at = optional_field(request, 'scheduledStartTimestamp')
+            if scheduled_at is not None and scheduled_at.ToNanoseconds() > now_timestamp().ToNanoseconds():
+                self._arm_timer(instance, scheduled_at, started)
+            else:
+                instance.inbox.append(started)
+                self._dispatch(instance)
+        return pb.CreateInstanceResponse(instanceId=instance_id)
+
+    def GetInstance(self, request, context):
+        with self._lock:
+            instance = self._instances.get(request.instanceId)
+            if instance is None:
+                return pb.GetInstanceResponse(exists=False)
+            return pb.GetInstanceResponse(exists=True, workflowState=instance.state(request.getInputsAndOutputs))
+
+    def WaitForInstanceStart(self, request, context):
+        return self._wait_for(request, context, lambda instance: instance.status != pb.ORCHESTRATION_STATUS_PENDING)
+
+    def WaitForInstanceCompletion(self, request, context):
+        return self._wait_for(request, context, lambda instance: instance.is_terminal())
+
+    def RaiseEvent(self, request, context):
+        self._add_event(context, request.instanceId, pb.HistoryEvent(
+            eventId=-1, timestamp=now_timestamp(),
+            eventRaised=pb.EventRaisedEvent(name=request.name, input=optional_field(request, 'input'))))
+        return pb.RaiseEventResponse()
+
+    def TerminateInstance(self, request, context):
+        self._add_event(context, request.instanceId, pb.HistoryEvent(
+            eventId=-1, timestamp=now_timestamp(),
+            executionTerminated=pb.ExecutionTerminatedEvent(input=optional_field(request, 'output'))))
+        return pb.TerminateResponse()
+
+    def SuspendInstance(self, request, context):
+        self._add_event(context, request.instanceId, pb.HistoryEvent(
+            eventId=-1, timestamp=now_timestamp(),
+            executionSuspended=pb.ExecutionSuspendedEvent(input=optional_field(request, 'reason'))),
+            status=pb.ORCHESTRATION_STATUS_SUSPENDED)
+        return pb.SuspendResponse()
+
+    def ResumeInstance(self, request, context):
+        self._add_event(context, request.instanceId, pb.HistoryEvent(
+            eventId=-1, timestamp=now_timestamp(),
+            executionResumed=pb.ExecutionResumedEvent(input=optional_field(request, 'reason'))),
+            status=pb.ORCHESTRATION_STATUS_RUNNING)
+        return pb.ResumeResponse()
+
+    def PurgeInstances(self, request, context):
+        if not request.instanceId:
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, 'only purging by instance id is supported')
+        with self._lock:
+            instance = self._instances.get(request.instanceId)
+            deleted = 0
+            if instance is not None and (instance.is_terminal() or request.force):
+                del self._instances[request.instanceId]
+                deleted = 1
+        return pb.PurgeInstancesResponse(deletedInstanceCount=deleted,
+                                         isComplete=wrappers_pb2.BoolValue(value=True))
+
+    # endregion
+
+    # region Worker API
+
+    def GetWorkItems(self, request, context):
+        delivered = set()
+        try:
+            while context.is_active() and not self._stopped:
+                try:
+                    work_item = self._work_items.get(timeout=self.poll_seconds)
+                except queue.Empty:
+                    continue
+                with self._lock:
+                    if work_item.completionToken not in self._outstanding:
+                        continue
+                    if len(delivered) > 10000:
+                        delivered = {token for token in delivered if token in self._outstanding}
+                delivered.add(work_item.completionToken)
+                yield work_item
+        finally:
+            # work items the worker took but never completed are handed to the next worker
+            with self._lock:
+                abandoned = [self._outstanding[token] for token in delivered if token in self._outstanding]
+                self.redispatched += len(abandoned)
+            for work_item in abandoned:
+                self._work_items.put(work_item)
+            if abandoned:
+                logging.warning('Worker stream closed with %d unfinished work items, queued them again', len(abandoned))
+
+    def CompleteOrchestratorTask(self, request, context):
+        with self._lock:
+            if self._outstanding.pop(request.completionToken, None) is None:
+                return pb.CompleteTaskResponse()
+            instance = self._instances.get(request.instanceId)
+            if instance is None or instance.token != request.completionToken:
+                return pb.CompleteTaskResponse()
+
+            instance.history.extend(instance.dispatched)
+            instance.dispatched = None
+            instance.token = None
+            if request.HasField('customStatus'):
+                instance.custom_status = request.customStatus
+            for action in request.actions:
+                self._apply(instance, action)
+            instance.last_updated_at = now_timestamp()
+
+            self._dispatch(instance)
+            self._state_changed.notify_all()
+        return pb.CompleteTaskResponse()
+
+    def CompleteActivityTask(self, request, context):
+        with self._lock:
+            work_item = self._outstanding.pop(request.completionToken, None)
+            if work_item is None:
+                return pb.CompleteTaskResponse()
+            activity = work_item.activityRequest
+            instance = self._instances.get(request.instanceId)
+            if (instance is None or instance.is_terminal()
+                    or instance.execution_id != activity.workflowInstance.executionId.value):
+                return pb.CompleteTaskResponse()
+
+            if request.HasField('failureDetails'):
+                event = pb.HistoryEvent(
+                    eventId=-1, timestamp=now_timestamp(),
+                    taskFailed=pb.TaskFailedEvent(
+                        taskScheduledId=request.taskId,
+                        failureDetails=request.failureDetails,
+                        taskExecutionId=activity.taskExecutionId))
+            else:
+                event = pb.HistoryEvent(
+                    eventId=-1, timestamp=now_timestamp(),
+                    taskCompleted=pb.TaskCompletedEvent(
+                        taskScheduledId=request.taskId,
+                        result=optional_field(request, 'result'),
+                        taskExecutionId=activity.taskExecutionId))
+            instance.inbox.append(event)
+            self._dispatch(instance)
+        return pb.CompleteTaskResponse()
+
+    # endregion
+
+    def _dispatch(self, instance: Instance):
+        if instance.token is not None or not instance.inbox:
+            return
+        if instance.is_terminal():
+            instance.inbox.clear()
+            return
+
+        new_events = [pb.HistoryEvent(eventId=-1, timestamp=now_timestamp(),
+                                      workflowStarted=pb.WorkflowStartedEvent())] + instance.inbox
+        instance.inbox = []
+        instance.dispatched = new_events
+        instance.token = uuid.uuid4().hex
+        if instance.status == pb.ORCHESTRATION_STATUS_PENDING:
+            instance.status = pb.ORCHESTRATION_STATUS_RUNNING
+
+        self.workflow_items += 1
+        self._enqueue(pb.WorkItem(
+            workflowRequest=pb.WorkflowRequest(
+                instanceId=instance.instance_id,
+                executionId=wrappers_pb2.StringValue(value=instance.execution_id),
+                pastEvents=instance.history,
+                newEvents=new_events),
+            completionToken=instance.token))
+
+    def _enqueue(self, work_item: pb.WorkItem):
+        self._outstanding[work_item.completionToken] = work_item
+        self._work_items.put(work_item)
+
+    def _apply(self, instance: Instance, action: pb.WorkflowAction):
+        kind = action.WhichOneof('workflowActionType')
+
+        if kind == 'scheduleTask':
+            task = action.scheduleTask
+            instance.history.append(pb.HistoryEvent(
+                eventId=action.id, timestamp=now_timestamp(),
+                taskScheduled=pb.TaskScheduledEvent(
+                    name=task.name,
+                    version=optional_field(task, 'version'),
+                    input=optional_field(task, 'input'),
+                    taskExecutionId=task.taskExecutionId)))
+            self.activity_items += 1
+            self._enqueue(pb.WorkItem(
+                activityRequest=pb.ActivityRequest(
+                    name=task.name,
+                    version=optional_field(task, 'version'),
+                    input=optional_field(task, 'input'),
+                    workflowInstance=pb.WorkflowInstance(
+                        instanceId=instance.instance_id,
+                        executionId=wrappers_pb2.StringValue(value=instance.execution_id)),
+                    taskId=action.id,
+                    taskExecutionId=task.taskExecutionId),
+                completionToken=uuid.uuid4().hex))
+
+        elif kind == 'createTimer':
+            timer = action.createTimer
+            created = pb.HistoryEvent(eventId=action.id, timestamp=now_timestamp(),
+                                      timerCreated=pb.TimerCreatedEvent(fireAt=timer.fireAt))
+            if timer.HasField('name'):
+                created.timerCreated.name = timer.name
+            origin = timer.WhichOneof('origin')
+            if origin:
+                getattr(created.timerCreated, origin).CopyFrom(getattr(timer, origin))
+            instance.history.append(created)
+            self._arm_timer(instance, timer.fireAt, pb.HistoryEvent(
+                eventId=-1, timerFired=pb.TimerFiredEvent(fireAt=timer.fireAt, timerId=action.id)))
+
+        elif kind == 'completeWorkflow':
+            completion = action.completeWorkflow
+            if completion.workflowStatus == pb.ORCHESTRATION_STATUS_CONTINUED_AS_NEW:
+                instance.input = optional_field(completion, 'result')
+                instance.execution_id = uuid.uuid4().hex
+                instance.history = []
+                instance.inbox = [instance.execution_started()] + list(completion.carryoverEvents)
+                return
+            self._complete(instance, completion.workflowStatus,
+                           optional_field(completion, 'result'), optional_field(completion, 'failureDetails'))
+
+        else:
+            logging.error('Failing workflow %s, %s actions are not supported', instance.instance_id, kind)
+            self._complete(instance, pb.ORCHESTRATION_STATUS_FAILED, None, pb.TaskFailureDetails(
+                errorType='NotImplementedError',
+                errorMessage='%s actions are not supported by the local workflow backend' % kind))
+
+    def _complete(self, instance: Instance, status: int, output, failure_details):
+        instance.status = status
+        instance.output = output
+        instance.failure_details = failure_details
+        instance.completed_at = now_timestamp()
+        instance.inbox.clear()
+        instance.history.append(pb.HistoryEvent(
+            eventId=-1, timestamp=instance.completed_at,
+            executionCompleted=pb.ExecutionCompletedEvent(
+                workflowStatus=status, result=output, failureDetails=failure_details)))
+
+    def _add_event(self, context, instance_id: str, event: pb.HistoryEvent, status: Optional[int] = None):
+        with self._lock:
+            instance = self._instances.get(instance_id)
+            if instance is None:
+                context.abort(grpc.StatusCode.NOT_FOUND, 'workflow instance %s does not exist' % instance_id)
+            if instance.is_terminal():
+                return
+            if status is not None:
+                instance.status = status
+            instance.inbox.append(event)
+            self._dispatch(instance)
+
+    def _wait_for(self, request, context, predicate):
+        with self._lock:
+            done = self._state_changed.wait_for(
+                lambda: self._stopped or self._instances.get(request.instanceId) is None
+                or predicate(self._instances[request.instanceId]),
+                context.time_remaining())
+            if not done:
+                context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, 'timed out waiting for %s' % request.instanceId)
+            instance = self._instances.get(request.instanceId)
+            if instance is None:
+                return pb.GetInstanceResponse(exists=False)
+            return pb.GetInstanceResponse(exists=True, workflowState=instance.state(request.getInputsAndOutputs))
+
+    def _arm_timer(self, instance: Instance, fire_at: timestamp_pb2.Timestamp, event: pb.HistoryEvent):
+        self._timer_sequence += 1
+        deadline = fire_at.ToDatetime(tzinfo=timezone.utc).timestamp()
+        heapq.heappush(self._timers,
+                       (deadline, self._timer_sequence, instance.instance_id, instance.execution_id, event))
+        self._timers_changed.notify()
+
+    def _run_timers(self):
+        with self._lock:
+            while not self._stopped:
+                now = now_timestamp().ToNanoseconds() / 1e9
+                while self._timers and self._timers[0][0] <= now:
+                    _, _, instance_id, execution_id, event = heapq.heappop(self._timers)
+                    instance = self._instances.get(instance_id)
+                    if instance is None or instance.execution_id != execution_id or instance.is_terminal():
+                        continue
+                    event.timestamp.CopyFrom(now_timestamp())
+                    if event.HasField('timerFired'):
+                        self.timers_fired += 1
+                    instance.inbox.append(event)
+                    self._dispatch(instance)
+                self._timers_changed.wait(self._timers[0][0] - now if self._timers else None)
@@ -31,6 +31,10 @@ for app in config_data['apps']:
         app['appPort'] = 5005
         app['workDir'] = './services/union-vault'
         app['command'] = ['uvicorn', 'main:app', '--port', '5005']
+    if app['appId'] == 'bank-simulator':
+        app['appPort'] = 5007
+        app['workDir'] = './services/bank-simulator'
+        app['command'] = ['uvicorn', 'main:app', '--port', '5007']
 
 updated_data = {
     'project': config_data['project'],
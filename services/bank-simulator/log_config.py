@@ -0,0 +1,122 @@
+# Canonical copy in shared/log_config.py, vendored into the services by shared/sync.py. Edit it there, not here.
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+import orjson
+
+from metrics import Counter
+from tracing import current_span, service_name
+
+'''
+    Logging setup shared by the services. Records are put on a queue by the calling thread and formatted and
+    written by a background listener, so a request thread never waits on the log output. The calling thread only merges
+    the message arguments and captures the trace context of the current span.
+
+    Per-event success logs pass extra=SAMPLED and are kept for LOG_SAMPLE_RATE of the events, everything else is
+    always kept. Log calls use %-style arguments, they are only merged once a record passed the level check.
+
+    LOG_LEVEL - level of the service's root logger.
+    LOG_LEVELS - comma separated logger=LEVEL overrides, e.g. httpx=WARNING,uvicorn.access=WARNING.
+    LOG_FORMAT - json (one JSON object per line) or text.
+    LOG_SAMPLE_RATE - share of sampled records that are written, 0 drops them and 1 keeps them all.
+    LOG_QUEUE_SIZE - records buffered for the listener, records beyond it are dropped instead of blocking.
+'''
+
+log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+log_levels = os.getenv('LOG_LEVELS', '')
+log_format = os.getenv('LOG_FORMAT', 'json')
+log_sample_rate = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+log_queue_size = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+SAMPLED = {'sampled': True}
+
+log_records_dropped = Counter('log_records_dropped_total', 'Log records dropped because the log queue was full.')
+
+# attributes every LogRecord has, anything else was passed with extra= and is written as a field
+standard_attributes = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'sampled'}
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(record, 'sampled', False) or random.random() < self.rate
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread without formatting them, dropping them when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # arguments may change after the call returns, so the message is merged here, the rest is left to the listener
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        active = current_span.get()
+        if active is not None:
+            record.trace_id = active.context.trace_id
+            record.span_id = active.context.span_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'service': service_name,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in standard_attributes:
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return orjson.dumps(entry, default=str).decode('utf-8')
+
+
+_listener = None
+
+
+def configure_logging():
+    """Routes the root logger through the queue, once per process."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == 'json' else
+                        logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    handler = AsyncQueueHandler(queue.Queue(log_queue_size))
+    handler.addFilter(SamplingFilter(log_sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(log_level)
+    for override in filter(None, log_levels.split(',')):
+        name, level = override.split('=', 1)
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
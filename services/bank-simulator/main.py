@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import random
+from typing import Dict, List
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request, Response
+from log_config import configure_logging
+from model.bank_model import BankLoanBatchRequest, BankLoanRequest, LenderProfile
+from metrics import RequestMetricsMiddleware, metrics_content_type, render_metrics
+from quote_cache import quote_cache
+from tracing import TracingMiddleware
+
+'''
+    Hosts many simulated lenders in one process for load and scale testing. Every lender applies the same rules
+    as the standalone bank services (riverstone-bank, titanium-trust, union-vault), parameterised by its profile.
+
+    LENDERS_FILE - path to a JSON list of lender profiles (bank_id, min_credit_score, max_loan_amount, base_rate).
+    SYNTHETIC_LENDERS - the number of generated lenders added on top of the file, for scale tests.
+    SYNTHETIC_LENDERS_SEED - seed for the generated profiles so runs are repeatable.
+    SIMULATOR_APP_ID - the Dapr app id of this service, used in the registry served on /registry.
+
+    Approved quotes carry a quoteId and their expiresAt, and are given again for the same profile and lender
+    while they are valid (see quote_cache.py).
+
+    A lender is addressed either by route (/banks/{bank_id}/loan-quote) or, on the plain /loan-quote routes,
+    by the x-bank-id header, the dapr-app-id header or the first label of the Host header, in that order.
+    GET /capabilities serves the eligibility rules of a lender the same two ways.
+'''
+
+lenders_file = os.getenv('LENDERS_FILE', os.path.join(os.path.dirname(__file__), 'lenders.json'))
+synthetic_lenders = int(os.getenv('SYNTHETIC_LENDERS', '0'))
+synthetic_lenders_seed = int(os.getenv('SYNTHETIC_LENDERS_SEED', '42'))
+simulator_app_id = os.getenv('SIMULATOR_APP_ID', 'bank-simulator')
+
+configure_logging()
+app = FastAPI()
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+rng = np.random.default_rng()
+
+
+class Lender:
+
+    def __init__(self, profile: LenderProfile):
+        # everything a quote needs is resolved once, not per call
+        self.bank_id = profile.bank_id
+        self.min_credit_score = profile.min_credit_score
+        self.max_loan_amount = profile.max_loan_amount
+        self.base_rate = float(profile.base_rate)
+        self.profile = profile
+        self.denied = {
+            'status': 'DENIED',
+            'bankId': self.bank_id,
+            'message': 'Loan Rejected'
+        }
+
+    def approved(self, amount: int, term: int, score: int, rate: float):
+        return {
+            'status': 'APPROVED',
+            'quote': quote_cache.quote(self.bank_id, amount, term, score, rate)
+        }
+
+    def capabilities(self):
+        return {
+            'bankId': self.bank_id,
+            'min_credit_score': self.min_credit_score,
+            'max_loan_amount': self.max_loan_amount
+        }
+
+    def quote(self, amount: int, term: int, score: int):
+        if amount <= self.max_loan_amount and score >= self.min_credit_score:
+            return self.approved(amount, term, score, self.base_rate + random.random() * ((1000 - score) / 100.0))
+        return self.denied
+
+    def quotes(self, amounts: np.ndarray, terms: np.ndarray, scores: np.ndarray):
+        eligible = (amounts <= self.max_loan_amount) & (scores >= self.min_credit_score)
+        rates = self.base_rate + rng.random(len(amounts)) * ((1000 - scores) / 100.0)
+        return [self.approved(amount, term, score, rate) if approved else self.denied
+                for approved, rate, amount, term, score in zip(eligible.tolist(), rates.tolist(), amounts.tolist(),
+                                                               terms.tolist(), scores.tolist())]
+
+
+def load_lender_profiles(path: str) -> List[LenderProfile]:
+    with open(path, 'r') as file:
+        return [LenderProfile(**profile) for profile in json.load(file)]
+
+
+def synthetic_lender_profiles(count: int, seed: int) -> List[LenderProfile]:
+    generator = np.random.default_rng(seed)
+    return [
+        LenderProfile(
+            bank_id='sim-lender-%03d' % index,
+            min_credit_score=int(generator.integers(350, 750)),
+            max_loan_amount=int(generator.integers(10, 100)) * 10000,
+            base_rate=round(float(generator.uniform(2.5, 6.0)), 2)
+        )
+        for index in range(count)
+    ]
+
+
+def create_lenders() -> Dict[str, Lender]:
+    profiles = load_lender_profiles(lenders_file) + synthetic_lender_profiles(synthetic_lenders, synthetic_lenders_seed)
+    logging.info('Hosting %d lenders', len(profiles))
+    return {profile.bank_id: Lender(profile) for profile in profiles}
+
+
+lenders = create_lenders()
+
+
+def get_lender(bank_id: str) -> Lender:
+    lender = lenders.get(bank_id)
+    if lender is None:
+        raise HTTPException(status_code=404, detail='Unknown lender %s' % bank_id)
+    return lender
+
+
+def dispatch_lender(request: Request) -> Lender:
+    bank_id = request.headers.get('x-bank-id') or request.headers.get('dapr-app-id')
+    if not bank_id:
+        bank_id = request.headers.get('host', '').split(':')[0].split('.')[0]
+    return get_lender(bank_id)
+
+
+def loan_quote(lender: Lender, loanRequest: BankLoanRequest):
+    result = lender.quote(loanRequest.amount, loanRequest.term, loanRequest.credit.score)
+    logging.debug('%s answered loan request with %s', lender.bank_id, result['status'])
+    return result
+
+
+def loan_quotes(lender: Lender, batchRequest: BankLoanBatchRequest):
+    results = lender.quotes(np.asarray(batchRequest.amounts), np.asarray(batchRequest.terms),
+                            np.asarray(batchRequest.scores))
+    logging.info('%s quoted a batch of %d loan requests', lender.bank_id, len(results))
+    return {
+        'results': results
+    }
+
+
+@app.get("/")
+async def root():
+    return {"message": "Hello, World!"}
+
+@app.get('/metrics')
+def metrics():
+    return Response(content=render_metrics(), media_type=metrics_content_type)
+
+@app.get('/stats/quote-cache')
+def quote_cache_stats():
+    return quote_cache.stats()
+
+@app.get('/banks')
+def list_lenders():
+    return [lender.profile for lender in lenders.values()]
+
+@app.get('/registry')
+def lender_registry():
+    # bank registry entries for the loan broker (BANK_REGISTRY_FILE) pointing at the hosted lenders
+    return [{'app_id': simulator_app_id, 'path': '/banks/%s/loan-quote' % bank_id, 'weight': 1, 'enabled': True}
+            for bank_id in lenders]
+
+@app.get('/banks/{bank_id}/capabilities')
+def bank_capabilities(bank_id: str):
+    return get_lender(bank_id).capabilities()
+
+@app.post('/banks/{bank_id}/loan-quote')
+def bank_loan_request(bank_id: str, loanRequest: BankLoanRequest):
+    return loan_quote(get_lender(bank_id), loanRequest)
+
+@app.post('/banks/{bank_id}/loan-quotes')
+def bank_loan_batch_request(bank_id: str, batchRequest: BankLoanBatchRequest):
+    return loan_quotes(get_lender(bank_id), batchRequest)
+
+@app.get('/capabilities')
+def dispatched_capabilities(request: Request):
+    return dispatch_lender(request).capabilities()
+
+@app.post('/loan-quote')
+def dispatched_loan_request(request: Request, loanRequest: BankLoanRequest):
+    return loan_quote(dispatch_lender(request), loanRequest)
+
+@app.post('/loan-quotes')
+def dispatched_loan_batch_request(request: Request, batchRequest: BankLoanBatchRequest):
+    return loan_quotes(dispatch_lender(request), batchRequest)
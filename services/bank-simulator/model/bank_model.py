@@ -0,0 +1,32 @@
+from typing import List
+
+from pydantic import BaseModel, model_validator
+
+
+class Credit(BaseModel):
+    score: int  # clients credit score
+
+
+class BankLoanRequest(BaseModel):
+    amount: int  # loan amount
+    term: int  # the number of months until the loan has to be paid off
+    credit: Credit
+
+
+class BankLoanBatchRequest(BaseModel):
+    amounts: List[int]  # loan amount per applicant
+    terms: List[int]  # term in months per applicant
+    scores: List[int]  # credit score per applicant
+
+    @model_validator(mode='after')
+    def check_lengths(self):
+        if not len(self.amounts) == len(self.terms) == len(self.scores):
+            raise ValueError('amounts, terms and scores must have the same length')
+        return self
+
+
+class LenderProfile(BaseModel):
+    bank_id: str  # identifies the lender in quotes and routes
+    min_credit_score: int  # the customer's minimum credit score required to receive a quote
+    max_loan_amount: int  # the maximum amount the lender is willing to lend
+    base_rate: float  # the minimum rate the lender might give
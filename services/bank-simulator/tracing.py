@@ -0,0 +1,266 @@
+# Canonical copy in shared/tracing.py, vendored into the services by shared/sync.py. Edit it there, not here.
+import atexit
+import collections
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple, Optional, Union
+
+import orjson
+
+'''
+    W3C trace context (traceparent) propagation and span export. A span is started for every HTTP request,
+    continuing the trace of an incoming traceparent header, and the current span is handed on to outgoing calls
+    with inject(). Spans are written in the background as OTLP JSON lines, the format of the OpenTelemetry
+    collector's file exporter, so the files can be replayed into a collector or read by
+    benchmarks/critical_path.py.
+
+    TRACE_EXPORT_DIR - directory the spans are written to, one <service>.jsonl file per service. Empty disables export,
+        trace context is still propagated.
+    TRACE_SAMPLE_RATIO - share of new traces that are exported, the decision travels with the traceparent.
+    TRACE_EXPORT_INTERVAL_MS - how often buffered spans are written.
+    TRACE_EXPORT_QUEUE_SIZE - spans buffered between writes, spans beyond it are dropped.
+'''
+
+trace_export_dir = os.getenv('TRACE_EXPORT_DIR', '')
+trace_sample_ratio = float(os.getenv('TRACE_SAMPLE_RATIO', '1'))
+trace_export_interval_ms = float(os.getenv('TRACE_EXPORT_INTERVAL_MS', '1000'))
+trace_export_queue_size = int(os.getenv('TRACE_EXPORT_QUEUE_SIZE', '10000'))
+# the services run from their own directory, which is named after the app id
+service_name = os.getenv('DAPR_APP_ID') or os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+traceparent_regex = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    match = traceparent_regex.match(value.strip().lower()) if value else None
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return SpanContext(match.group(1), match.group(2), bool(int(match.group(3), 16) & 1))
+
+
+def format_traceparent(context: SpanContext) -> str:
+    return '00-%s-%s-%s' % (context.trace_id, context.span_id, '01' if context.sampled else '00')
+
+
+class Span:
+
+    __slots__ = ('name', 'kind', 'context', 'parent_id', 'attributes', 'start_ns', 'end_ns', 'error')
+
+    def __init__(self, name: str, kind: int, context: SpanContext, parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.kind = kind
+        self.context = context
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.context)
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self, error: Optional[str] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = error
+        if self.context.sampled:
+            exporter.export(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.context.trace_id,
+            'spanId': self.context.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error is not None else {'code': 1}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+def start_span(name: str, parent: Union[str, SpanContext, None] = None, kind: int = SPAN_KIND_INTERNAL,
+               attributes: Optional[dict] = None) -> Span:
+    """Starts a span under parent (a traceparent or span context), or under the current span when none is given.
+    The span is not made current, use span() for that."""
+    if isinstance(parent, str):
+        parent = parse_traceparent(parent)
+    if parent is None and current_span.get() is not None:
+        parent = current_span.get().context
+
+    span_id = '%016x' % random.getrandbits(64)
+    if parent is not None:
+        context = SpanContext(parent.trace_id, span_id, parent.sampled)
+    else:
+        context = SpanContext('%032x' % random.getrandbits(128), span_id, random.random() < trace_sample_ratio)
+    return Span(name, kind, context, parent.span_id if parent is not None else None, attributes or {})
+
+
+@contextmanager
+def span(name: str, parent: Union[str, SpanContext, None] = None, kind: int = SPAN_KIND_INTERNAL,
+         attributes: Optional[dict] = None):
+    """Runs the block in a new current span, which is ended and marked failed when the block raises."""
+    new_span = start_span(name, parent, kind, attributes)
+    token = current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as err:
+        new_span.end(error='%s: %s' % (type(err).__name__, err))
+        raise
+    finally:
+        current_span.reset(token)
+        new_span.end()
+
+
+def current_traceparent() -> Optional[str]:
+    active = current_span.get()
+    return active.traceparent if active is not None else None
+
+
+def inject(headers: dict) -> dict:
+    """Adds the traceparent of the current span to outgoing request headers."""
+    active = current_span.get()
+    if active is not None:
+        headers['traceparent'] = active.traceparent
+    return headers
+
+
+class SpanExporter:
+    """Buffers finished spans and appends them to the export file from a background thread, one line per write."""
+
+    def __init__(self, directory: str, interval_ms: float, queue_size: int):
+        self.path = os.path.join(directory, '%s.jsonl' % service_name) if directory else None
+        self.interval_seconds = interval_ms / 1000.0
+        self.exported = 0
+        self.dropped = 0
+        self._spans = collections.deque(maxlen=queue_size)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        if self.path:
+            os.makedirs(directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def export(self, finished: Span):
+        if self._thread is None:
+            return
+        if len(self._spans) == self._spans.maxlen:
+            self.dropped += 1
+        self._spans.append(finished)
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(5)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            self._write()
+        self._write()
+
+    def _write(self):
+        spans = []
+        while self._spans:
+            spans.append(self._spans.popleft())
+        if not spans:
+            return
+
+        line = orjson.dumps({'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+            'scopeSpans': [{'scope': {'name': service_name}, 'spans': [finished.to_otlp() for finished in spans]}]
+        }]})
+        try:
+            with self._lock, open(self.path, 'ab') as file:
+                file.write(line + b'\n')
+            self.exported += len(spans)
+        except OSError as err:
+            logging.error('Failed to write %d spans to %s: %s', len(spans), self.path, err)
+
+    def stats(self) -> dict:
+        return {
+            'path': self.path,
+            'pending': len(self._spans),
+            'exported': self.exported,
+            'dropped': self.dropped
+        }
+
+
+exporter = SpanExporter(trace_export_dir, trace_export_interval_ms, trace_export_queue_size)
+
+
+class TracingMiddleware:
+    """Runs every HTTP request in a server span that continues the trace of its traceparent header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope['headers']:
+            if key == b'traceparent':
+                traceparent = value.decode('latin-1')
+                break
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        with span(scope['method'], traceparent, SPAN_KIND_SERVER) as server_span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # named after the route template once routing has happened
+                route = scope.get('route')
+                server_span.name = '%s %s' % (scope['method'], route.path if route is not None else scope['path'])
+                server_span.set_attribute('http.response.status_code', status[0])
+                if status[0] >= 500:
+                    server_span.error = 'HTTP %d' % status[0]
@@ -1,44 +1,86 @@
 import random
 import re
-from fastapi import FastAPI, HTTPException
+import numpy as np
+from fastapi import FastAPI, HTTPException, Response
 import grpc
 import logging
-from model.credit_request import CreditRequest
+from log_config import configure_logging
+from model.credit_request import CreditRequest, CreditRequestBatch
+from metrics import RequestMetricsMiddleware, metrics_content_type, render_metrics
+from tracing import TracingMiddleware
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
+
+MIN_SCORE = 300
+MAX_SCORE = 900
+MIN_HISTORY = 1
+MAX_HISTORY = 30
+
+ssn_regex = re.compile(r"^\d{3}-\d{2}-\d{4}$")
+rng = np.random.default_rng()
 
 def get_random_int(min_value, max_value):
     return min_value + random.randint(0, max_value - min_value)
 
 
+def credit_score_response(request_id: str, ssn: str, score: int, history: int):
+    return {
+        'statusCode': 200,
+        'request_id': request_id,
+        'body': {
+            'SSN': ssn,
+            'score': score,
+            'history': history,
+        }
+    }
+
+
+def invalid_ssn_response(request_id: str, ssn: str):
+    return {
+        'statusCode': 400,
+        'request_id': request_id,
+        'body': {
+            'SSN': ssn,
+        }
+    }
+
+
 app = FastAPI()
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 @app.get("/")
 async def root():
     return {"message": "Hello, World!"}
 
+@app.get('/metrics')
+def metrics():
+    return Response(content=render_metrics(), media_type=metrics_content_type)
+
 @app.post('/credit-score')
 def credit_bureau_service(cbModel: CreditRequest):
-    
-    min_score = 300
-    max_score = 900
-
-    ssn_regex = re.compile(r"^\d{3}-\d{2}-\d{4}$")
     if ssn_regex.match(cbModel.SSN):
-        return {
-            'statusCode': 200,
-            'request_id': cbModel.request_id,
-            'body': {
-                'SSN': cbModel.SSN,
-                'score': get_random_int(min_score, max_score),
-                'history': get_random_int(1, 30),
-            }
-        }
+        return credit_score_response(cbModel.request_id, cbModel.SSN,
+                                     get_random_int(MIN_SCORE, MAX_SCORE), get_random_int(MIN_HISTORY, MAX_HISTORY))
     else:
-        return {
-            'statusCode': 400,
-            'request_id': cbModel.request_id,
-            'body': {
-                'SSN': cbModel.SSN,
-            }
-        }
+        return invalid_ssn_response(cbModel.request_id, cbModel.SSN)
+
+@app.post('/credit-scores')
+def credit_bureau_batch_service(batch: CreditRequestBatch):
+    requests = batch.requests
+
+    # draw every score and history in one pass, entries for invalid SSNs are simply not used
+    scores = rng.integers(MIN_SCORE, MAX_SCORE, size=len(requests), endpoint=True).tolist()
+    history = rng.integers(MIN_HISTORY, MAX_HISTORY, size=len(requests), endpoint=True).tolist()
+
+    results = [
+        credit_score_response(request.request_id, request.SSN, score, months)
+        if ssn_regex.match(request.SSN) else invalid_ssn_response(request.request_id, request.SSN)
+        for request, score, months in zip(requests, scores, history)
+    ]
+    logging.info('Scored a batch of %d credit requests', len(results))
+
+    return {
+        'statusCode': 200,
+        'results': results
+    }
@@ -1,6 +1,12 @@
+from typing import List
+
 from pydantic import BaseModel
 
 
 class CreditRequest(BaseModel):
     request_id: str
     SSN: str
+
+
+class CreditRequestBatch(BaseModel):
+    requests: List[CreditRequest]
@@ -0,0 +1,29 @@
+import json
+import logging
+import os
+from typing import List
+
+from model.bank_model import BankProfile
+
+'''
+    The banks the loan broker asks for quotes are loaded from a JSON registry instead of being hard-coded.
+
+    BANK_REGISTRY_FILE - path to the registry, a JSON list of bank profiles (app_id, path, weight, enabled).
+    MAX_IN_FLIGHT_QUOTES - the maximum number of bank quote activities a single workflow runs at once.
+'''
+
+bank_registry_file = os.getenv('BANK_REGISTRY_FILE', os.path.join(os.path.dirname(__file__), 'banks.json'))
+max_in_flight_quotes = int(os.getenv('MAX_IN_FLIGHT_QUOTES', '10'))
+
+
+def load_bank_registry(path: str = bank_registry_file) -> List[BankProfile]:
+    with open(path, 'r') as file:
+        banks = [BankProfile(**bank) for bank in json.load(file)]
+
+    logging.info('Loaded %d banks from registry %s', len(banks), path)
+    return banks
+
+
+def enabled_banks(banks: List[BankProfile]) -> List[BankProfile]:
+    # highest weight first, registry order is kept for banks with the same weight
+    return sorted([bank for bank in banks if bank.enabled], key=lambda bank: -bank.weight)
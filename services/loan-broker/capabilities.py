@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from http_client import get_json
+
+'''
+    Eligibility rules of the registered banks, read from their GET /capabilities endpoint and refreshed in the
+    background. Quote activities are only scheduled for banks whose rules the applicant meets, the other banks
+    are recorded as PRE_DENIED without being called. A bank whose rules are not known (yet) is always asked.
+
+    PREFILTER_ENABLED - false to ask every bank, whatever its rules.
+    CAPABILITIES_REFRESH_SECONDS - how often the rules are read again.
+    CAPABILITIES_RETRY_SECONDS - how soon a bank that did not answer is asked again.
+'''
+
+prefilter_enabled = os.getenv('PREFILTER_ENABLED', 'true').lower() == 'true'
+capabilities_refresh_seconds = float(os.getenv('CAPABILITIES_REFRESH_SECONDS', '60'))
+capabilities_retry_seconds = float(os.getenv('CAPABILITIES_RETRY_SECONDS', '5'))
+
+dapr_http_endpoint = os.getenv('DAPR_HTTP_ENDPOINT', 'http://localhost')
+dapr_api_token = os.getenv('DAPR_API_TOKEN', '')
+
+
+def capabilities_path(bank: dict) -> str:
+    # served next to the quote endpoint, /banks/{id}/loan-quote has /banks/{id}/capabilities
+    return bank.get('capabilities_path') or '%s/capabilities' % bank['path'].rsplit('/', 1)[0]
+
+
+def pre_denied_quote(bank: dict) -> dict:
+    return {
+        'status': 'PRE_DENIED',
+        'bankId': bank['app_id'],
+        'message': 'Applicant does not meet the eligibility rules of the bank'
+    }
+
+
+class CapabilityCache:
+
+    def __init__(self, banks: List[dict], refresh_seconds: float, retry_seconds: float):
+        self.banks = banks
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+        self.refreshes = 0
+        self.failures = 0
+        self.pre_denied = 0
+        self._rules: Dict[str, dict] = {}  # bank key -> capabilities
+        self._loaded_at: Dict[str, float] = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bank-capabilities', daemon=True)
+
+    def start(self):
+        if prefilter_enabled:
+            self._thread.start()
+
+    def close(self, timeout: Optional[float] = None):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def split(self, banks: List[dict], amount: int, score: int) -> Tuple[List[dict], List[dict]]:
+        """The banks worth asking and the PRE_DENIED results of the banks whose rules exclude the applicant."""
+        eligible = []
+        pre_denied = []
+        for bank in banks:
+            rules = self._rules.get(self._key(bank))
+            if rules is None or (amount <= rules['max_loan_amount'] and score >= rules['min_credit_score']):
+                eligible.append(bank)
+            else:
+                pre_denied.append(pre_denied_quote(bank))
+        if pre_denied:
+            self.pre_denied += len(pre_denied)
+        return eligible, pre_denied
+
+    def _key(self, bank: dict) -> str:
+        # simulated lenders share an app id, their path tells them apart
+        return '%s%s' % (bank['app_id'], bank['path'])
+
+    def _run(self):
+        while True:
+            failed = self._refresh()
+            if self._stopped.wait(self.retry_seconds if failed else self.refresh_seconds):
+                return
+
+    def _refresh(self) -> bool:
+        failed = False
+        for bank in self.banks:
+            key = self._key(bank)
+            if key in self._rules and time.monotonic() - self._loaded_at[key] < self.refresh_seconds:
+                continue
+            try:
+                rules = get_json(
+                    url='%s%s' % (dapr_http_endpoint, capabilities_path(bank)),
+                    headers={'dapr-app-id': bank['app_id'], 'dapr-api-token': dapr_api_token})
+                self._rules[key] = {'min_credit_score': int(rules['min_credit_score']),
+                                    'max_loan_amount': int(rules['max_loan_amount'])}
+                self._loaded_at[key] = time.monotonic()
+                self.refreshes += 1
+            except Exception as err:
+                # the last known rules stay in use, a bank that never answered is asked for every request
+                logging.warning('Could not read the capabilities of %s: %s', bank['app_id'], err)
+                self.failures += 1
+                failed = True
+        return failed
+
+    def stats(self) -> dict:
+        return {
+            'enabled': prefilter_enabled,
+            'banks': len(self.banks),
+            'known': len(self._rules),
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'pre_denied': self.pre_denied,
+            'rules': dict(self._rules)
+        }
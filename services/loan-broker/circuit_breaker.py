@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+from http_client import http_read_timeout
+from latency import LatencyWindow
+from metrics import Counter
+
+'''
+    Per-bank circuit breakers shared by every bank_quote activity of the process.
+
+    A breaker opens after BREAKER_FAILURE_THRESHOLD consecutive failures (timeouts, connection errors, 5xx) and
+    then rejects calls to the bank without sending them. After BREAKER_OPEN_SECONDS it lets
+    BREAKER_HALF_OPEN_PROBES calls through. One successful probe closes the breaker, a failed one opens it again.
+
+    The read timeout of each bank follows its recent latency: ADAPTIVE_TIMEOUT_MULTIPLIER times the
+    ADAPTIVE_TIMEOUT_PERCENTILE of the last ADAPTIVE_TIMEOUT_WINDOW successful calls, kept between
+    ADAPTIVE_TIMEOUT_MIN_MS and HTTP_READ_TIMEOUT_SECONDS. Until ADAPTIVE_TIMEOUT_MIN_SAMPLES calls were timed the
+    bank gets HTTP_READ_TIMEOUT_SECONDS.
+'''
+
+breaker_failure_threshold = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+breaker_open_seconds = float(os.getenv('BREAKER_OPEN_SECONDS', '10'))
+breaker_half_open_probes = int(os.getenv('BREAKER_HALF_OPEN_PROBES', '1'))
+adaptive_timeout_percentile = float(os.getenv('ADAPTIVE_TIMEOUT_PERCENTILE', '99'))
+adaptive_timeout_multiplier = float(os.getenv('ADAPTIVE_TIMEOUT_MULTIPLIER', '3'))
+adaptive_timeout_min_ms = float(os.getenv('ADAPTIVE_TIMEOUT_MIN_MS', '250'))
+adaptive_timeout_window = int(os.getenv('ADAPTIVE_TIMEOUT_WINDOW', '200'))
+adaptive_timeout_min_samples = int(os.getenv('ADAPTIVE_TIMEOUT_MIN_SAMPLES', '20'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+breaker_transitions = Counter(
+    'bank_circuit_transitions_total', 'Circuit breaker state changes per bank.', ('bank', 'state'))
+breaker_rejections = Counter(
+    'bank_circuit_rejections_total', 'Bank calls rejected by an open circuit breaker.', ('bank',))
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejections = 0
+        self.latencies = LatencyWindow(adaptive_timeout_window, adaptive_timeout_percentile,
+                                       adaptive_timeout_min_samples)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now. Every allowed call must be followed by record_success or record_failure."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < breaker_open_seconds:
+                    return self._reject()
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.probes_in_flight >= breaker_half_open_probes:
+                    return self._reject()
+                self.probes_in_flight += 1
+            return True
+
+    def record_success(self, seconds: float):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                # a call sent before the breaker opened can finish now, it proves the bank answers just as well
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                self._transition(CLOSED)
+            self.latencies.add(seconds)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                self._open()
+            elif self.state == CLOSED and self.consecutive_failures >= breaker_failure_threshold:
+                self._open()
+
+    def timeout(self) -> float:
+        percentile = self.latencies.value()
+        if percentile is None:
+            return http_read_timeout
+        return min(http_read_timeout, max(adaptive_timeout_min_ms / 1000.0, percentile * adaptive_timeout_multiplier))
+
+    def _reject(self) -> bool:
+        self.rejections += 1
+        breaker_rejections.inc(self.name)
+        return False
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._transition(OPEN)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logging.warning('Circuit breaker of %s changed from %s to %s', self.name, self.state, state)
+        self.state = state
+        breaker_transitions.inc(self.name, state)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'successes': self.successes,
+                'failures': self.failures,
+                'rejections': self.rejections,
+                'timeout_ms': self.timeout() * 1000.0
+            }
+
+
+class BreakerRegistry:
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(name, CircuitBreaker(name))
+        return breaker
+
+    def stats(self) -> dict:
+        return {name: breaker.stats() for name, breaker in list(self._breakers.items())}
+
+
+bank_breakers = BreakerRegistry()
@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+'''
+    In-process cache of credit bureau results, keyed by a hash of the SSN so raw SSNs are never held as keys.
+
+    CREDIT_CACHE_SIZE - the maximum number of applicants kept, the least recently used entry is evicted first.
+    CREDIT_CACHE_TTL_SECONDS - how long a bureau result is reused before it is looked up again.
+    CREDIT_CACHE_SALT - mixed into the SSN hash so cache keys cannot be matched against a plain SSN hash.
+'''
+
+credit_cache_size = int(os.getenv('CREDIT_CACHE_SIZE', '10000'))
+credit_cache_ttl_seconds = float(os.getenv('CREDIT_CACHE_TTL_SECONDS', '300'))
+credit_cache_salt = os.getenv('CREDIT_CACHE_SALT', '')
+
+
+class CreditScoreCache:
+
+    def __init__(self, max_size: int, ttl_seconds: float, salt: str = ''):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.salt = salt
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}  # key -> asyncio.Task shared by concurrent lookups of the same SSN
+        self._lock = threading.Lock()
+
+    def key(self, ssn: str) -> str:
+        return hashlib.sha256((self.salt + ssn).encode('utf-8')).hexdigest()
+
+    async def get_or_load(self, ssn: str, loader: Callable[[], Awaitable[dict]]) -> dict:
+        key = self.key(ssn)
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+            task = self._in_flight.get(key)
+            if task is None:
+                self.misses += 1
+                task = asyncio.ensure_future(loader())
+                task.add_done_callback(lambda done: self._loaded(key, done))
+                self._in_flight[key] = task
+            else:
+                self.coalesced += 1
+
+        # the lookup runs as a task of its own, shielded so a cancelled caller, even the one that started it,
+        # stops waiting without cancelling the lookup for everyone else
+        return await asyncio.shield(task)
+
+    def _loaded(self, key: str, task: asyncio.Task):
+        with self._lock:
+            if self._in_flight.get(key) is task:
+                del self._in_flight[key]
+            # exception() also marks the error as retrieved when every caller stopped waiting
+            if not task.cancelled() and task.exception() is None:
+                self._store(key, task.result())
+
+    def get(self, ssn: str) -> Optional[dict]:
+        with self._lock:
+            value = self._lookup(self.key(ssn))
+            if value is None:
+                self.misses += 1
+            return value
+
+    def put(self, ssn: str, value: dict):
+        with self._lock:
+            self._store(self.key(ssn), value)
+
+    def _lookup(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def _store(self, key: str, value: dict):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions
+            }
+
+
+credit_score_cache = CreditScoreCache(credit_cache_size, credit_cache_ttl_seconds, credit_cache_salt)
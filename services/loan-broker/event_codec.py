@@ -0,0 +1,44 @@
+import os
+from typing import Dict, Optional
+
+import msgpack
+import orjson
+
+'''
+    Encoding of the quote-aggregate event published to the quotes topic.
+
+    Version 2 events are the ranked quote aggregate itself, encoded exactly once. The quote-aggregator stores the
+    event bytes as they arrive, without decoding and re-encoding them. What describes the event rather than the
+    aggregate travels in the CloudEvent envelope: the type names the event and its schema version, and the
+    traceparent of the publishing span is set per event because a bulk publish mixes events of many traces.
+    Version 1 events wrapped a JSON string of the aggregate inside a second JSON document.
+
+    EVENT_CONTENT_TYPE - application/json (compact JSON) or application/msgpack.
+'''
+
+EVENT_TYPE = 'quote-aggregate'
+SCHEMA_VERSION = 2
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+event_content_type = os.getenv('EVENT_CONTENT_TYPE', JSON_CONTENT_TYPE)
+
+
+def cloud_event_type() -> str:
+    return '%s.v%d' % (EVENT_TYPE, SCHEMA_VERSION)
+
+
+def encode_quote_event(quote_aggregate: dict, content_type: str = event_content_type) -> bytes:
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return msgpack.packb(quote_aggregate)
+    if content_type == JSON_CONTENT_TYPE:
+        return orjson.dumps(quote_aggregate)
+    raise ValueError('Unsupported event content type %s' % content_type)
+
+
+def quote_event_metadata(traceparent: Optional[str] = None) -> Dict[str, str]:
+    # Dapr overrides the attributes of the CloudEvent it wraps the event in with cloudevent.* metadata
+    metadata = {'cloudevent.type': cloud_event_type()}
+    if traceparent:
+        metadata['cloudevent.traceparent'] = traceparent
+    return metadata
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from latency import LatencyWindow
+from metrics import Counter
+
+'''
+    Hedged requests for the credit bureau and bank calls. When a call has not answered within the
+    HEDGE_PERCENTILE of its recent latencies, an identical second request is sent and the first acceptable
+    response wins. An async loser is cancelled. A blocking loser cannot be interrupted, it finishes in the
+    background and its response is dropped.
+
+    Every call adds HEDGE_BUDGET_PERCENT / 100 of a token to the target's budget and every hedge spends one, so
+    hedges never add more than that share of extra load. Until HEDGE_MIN_SAMPLES calls were timed there is
+    nothing to hedge against.
+
+    HEDGING_ENABLED - true to hedge calls, every call is sent once otherwise.
+    HEDGE_PERCENTILE - latency percentile after which the second request is sent.
+    HEDGE_MIN_DELAY_MS - the least time to wait before hedging, however fast the target usually is.
+    HEDGE_BUDGET_PERCENT - hedges allowed per 100 calls.
+    HEDGE_BUDGET_BURST - the most tokens a target can save up for a burst of slow calls.
+    HEDGE_WINDOW - latencies kept per target.
+    HEDGE_MIN_SAMPLES - latencies recorded before a target is hedged.
+    HEDGE_WORKERS - threads running the attempts of hedged blocking calls.
+'''
+
+hedging_enabled = os.getenv('HEDGING_ENABLED', 'false').lower() == 'true'
+hedge_percentile = float(os.getenv('HEDGE_PERCENTILE', '95'))
+hedge_min_delay_ms = float(os.getenv('HEDGE_MIN_DELAY_MS', '10'))
+hedge_budget_percent = float(os.getenv('HEDGE_BUDGET_PERCENT', '5'))
+hedge_budget_burst = float(os.getenv('HEDGE_BUDGET_BURST', '10'))
+hedge_window = int(os.getenv('HEDGE_WINDOW', '500'))
+hedge_min_samples = int(os.getenv('HEDGE_MIN_SAMPLES', '50'))
+hedge_workers = int(os.getenv('HEDGE_WORKERS', '64'))
+
+T = TypeVar('T')
+
+hedge_events = Counter('hedged_requests_total', 'Hedged requests by target and event (fired, won, no_budget).',
+                       ('target', 'event'))
+
+# attempts of blocking calls run here so the caller can wait for whichever finishes first
+executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='hedge')
+
+
+class Hedger:
+
+    def __init__(self, target: str):
+        self.target = target
+        self.latencies = LatencyWindow(hedge_window, hedge_percentile, hedge_min_samples)
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        self.no_budget = 0
+        self._tokens = hedge_budget_burst
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait for the first attempt before hedging, None when the call is not hedged."""
+        percentile = self.latencies.value()
+        if not hedging_enabled or percentile is None:
+            return None
+        return max(hedge_min_delay_ms / 1000.0, percentile)
+
+    def call(self, attempt: Callable[[], T], acceptable: Callable[[T], bool] = lambda result: True) -> T:
+        """Runs a blocking call, hedged once it is slower than usual. Raises the error of the last failed attempt."""
+        self._count_call()
+        delay = self.delay()
+        if delay is None:
+            return self._timed(attempt)
+
+        pending = {executor.submit(self._timed, attempt)}
+        done, pending = wait(pending, timeout=delay)
+        hedge = None
+        if pending and self._spend():
+            hedge = executor.submit(self._timed, attempt)
+            pending.add(hedge)
+
+        outcome = None
+        while True:
+            for future in done:
+                outcome = future
+                if future.exception() is None and acceptable(future.result()):
+                    self._record_win(future is hedge)
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+            if not pending:
+                return outcome.result()
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    async def call_async(self, attempt: Callable[[], Awaitable[T]],
+                         acceptable: Callable[[T], bool] = lambda result: True) -> T:
+        """Async variant of call, the losing attempt is cancelled."""
+        self._count_call()
+        delay = self.delay()
+        if delay is None:
+            return await self._timed_async(attempt)
+
+        pending = {asyncio.ensure_future(self._timed_async(attempt))}
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        hedge = None
+        if pending and self._spend():
+            hedge = asyncio.ensure_future(self._timed_async(attempt))
+            pending.add(hedge)
+
+        outcome = None
+        try:
+            while True:
+                for task in done:
+                    outcome = task
+                    if task.exception() is None and acceptable(task.result()):
+                        self._record_win(task is hedge)
+                        return task.result()
+                if not pending:
+                    return outcome.result()
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _timed(self, attempt: Callable[[], T]) -> T:
+        started = time.perf_counter()
+        result = attempt()
+        self.latencies.add(time.perf_counter() - started)
+        return result
+
+    async def _timed_async(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        started = time.perf_counter()
+        result = await attempt()
+        self.latencies.add(time.perf_counter() - started)
+        return result
+
+    def _count_call(self):
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(hedge_budget_burst, self._tokens + hedge_budget_percent / 100.0)
+
+    def _spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                self.no_budget += 1
+                hedge_events.inc(self.target, 'no_budget')
+                return False
+            self._tokens -= 1.0
+            self.fired += 1
+        hedge_events.inc(self.target, 'fired')
+        return True
+
+    def _record_win(self, hedge_won: bool):
+        if hedge_won:
+            with self._lock:
+                self.won += 1
+            hedge_events.inc(self.target, 'won')
+
+    def stats(self) -> dict:
+        delay = self.delay()
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'fired': self.fired,
+                'won': self.won,
+                'no_budget': self.no_budget,
+                'budget_tokens': round(self._tokens, 2),
+                'delay_ms': delay * 1000.0 if delay is not None else None
+            }
+
+
+class HedgerRegistry:
+
+    def __init__(self):
+        self._hedgers: Dict[str, Hedger] = {}
+        self._lock = threading.Lock()
+
+    def get(self, target: str) -> Hedger:
+        hedger = self._hedgers.get(target)
+        if hedger is None:
+            with self._lock:
+                hedger = self._hedgers.setdefault(target, Hedger(target))
+        return hedger
+
+    def stats(self) -> dict:
+        return {'enabled': hedging_enabled,
+                'targets': {target: hedger.stats() for target, hedger in list(self._hedgers.items())}}
+
+
+hedgers = HedgerRegistry()
@@ -0,0 +1,59 @@
+import os
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+'''
+    Process-wide HTTP transports used for every service invocation made through the Dapr HTTP endpoint.
+    The blocking session serves the workflow activities, the async client serves the FastAPI handlers.
+
+    HTTP_POOL_SIZE - the number of keep-alive connections kept open to the Dapr HTTP endpoint.
+    HTTP_CONNECT_TIMEOUT_SECONDS - how long to wait for a connection to be established.
+    HTTP_READ_TIMEOUT_SECONDS - how long to wait for the invoked app to answer.
+'''
+
+http_pool_size = int(os.getenv('HTTP_POOL_SIZE', '50'))
+http_connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT_SECONDS', '3'))
+http_read_timeout = float(os.getenv('HTTP_READ_TIMEOUT_SECONDS', '10'))
+
+
+def create_session() -> requests.Session:
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_pool_size, pool_block=True)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = create_session()
+
+
+def post_json(url: str, payload: dict, headers: dict, read_timeout: float = http_read_timeout) -> requests.Response:
+    return session.post(
+        url=url,
+        json=payload,
+        headers=headers,
+        timeout=(http_connect_timeout, read_timeout)
+    )
+
+
+def get_json(url: str, headers: dict) -> dict:
+    response = session.get(url=url, headers=headers, timeout=(http_connect_timeout, http_read_timeout))
+    response.raise_for_status()
+    return response.json()
+
+
+def create_async_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=http_pool_size, max_keepalive_connections=http_pool_size),
+        timeout=httpx.Timeout(http_read_timeout, connect=http_connect_timeout)
+    )
+
+
+async_client = create_async_client()
+
+
+async def post_json_async(url: str, payload: dict, headers: dict) -> httpx.Response:
+    return await async_client.post(url=url, json=payload, headers=headers)
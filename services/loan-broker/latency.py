@@ -0,0 +1,34 @@
+import threading
+from collections import deque
+from typing import Optional
+
+'''
+    Sliding window of recent call latencies and one percentile of them. The percentile is recomputed every
+    REFRESH_SAMPLES samples instead of sorting the window on every call.
+'''
+
+REFRESH_SAMPLES = 10
+
+
+class LatencyWindow:
+
+    def __init__(self, size: int, percentile: float, min_samples: int):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._since_refresh = 0
+        self._value: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self._since_refresh += 1
+            if self._since_refresh >= REFRESH_SAMPLES and len(self._samples) >= self.min_samples:
+                self._since_refresh = 0
+                ordered = sorted(self._samples)
+                self._value = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))]
+
+    def value(self) -> Optional[float]:
+        """The percentile in seconds, None until min_samples latencies were recorded."""
+        return self._value
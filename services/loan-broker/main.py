@@ -1,71 +1,449 @@
+import asyncio
 import json
 import os
 
-import requests
-from dapr.clients import DaprClient
-from fastapi import FastAPI, HTTPException
+import httpx
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
 import grpc
 import logging
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from pydantic import ValidationError
 from dapr.ext.workflow import WorkflowRuntime, DaprWorkflowClient, DaprWorkflowContext, when_all
+from dapr.ext.workflow.aio import DaprWorkflowClient as AioDaprWorkflowClient
+from credit_cache import credit_score_cache
+from hedging import hedgers
+from http_client import async_client, post_json_async
+from log_config import SAMPLED, configure_logging
+from metrics import Histogram, RequestMetricsMiddleware, metrics_content_type, render_metrics
 from model.credit_request import CreditRequest
 from model.loan_request import LoanRequest
-from workflow import union_vault_quote, titanium_trust_quote, riverstone_bank_quote, process_results, loan_broker_workflow, error_handler
+from bank_registry import load_bank_registry, enabled_banks, max_in_flight_quotes
+from capabilities import CapabilityCache, capabilities_refresh_seconds, capabilities_retry_seconds
+from circuit_breaker import bank_breakers
+from ranking import quote_scorer, scorers
+from request_index import request_index
+from tracing import SPAN_KIND_CLIENT, TracingMiddleware, current_span, current_traceparent, inject, span
+from workflow import bank_quote, process_results, loan_broker_workflow, error_handler, quote_publisher
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 credit_bureau_appid = os.getenv('CREDIT_BUREAU_APPID', 'credit-bureau')
 dapr_api_token = os.getenv('DAPR_API_TOKEN', '')
 dapr_http_endpoint = os.getenv('DAPR_HTTP_ENDPOINT', 'http://localhost')
+# publish once QUOTE_QUORUM quotes were approved or QUOTE_DEADLINE_SECONDS passed, 0 waits for every bank
+quote_quorum = int(os.getenv('QUOTE_QUORUM', '0'))
+quote_deadline_seconds = float(os.getenv('QUOTE_DEADLINE_SECONDS', '0'))
+# bulk submissions resolve credit scores BULK_BUREAU_CHUNK_SIZE applicants per bureau call, with at most
+# BULK_BUREAU_CONCURRENCY of those calls in flight
+bulk_bureau_chunk_size = int(os.getenv('BULK_BUREAU_CHUNK_SIZE', '500'))
+bulk_bureau_concurrency = int(os.getenv('BULK_BUREAU_CONCURRENCY', '4'))
+bulk_schedule_concurrency = int(os.getenv('BULK_SCHEDULE_CONCURRENCY', '32'))
 
-app = FastAPI()
+credit_bureau_seconds = Histogram(
+    'credit_bureau_request_duration_seconds', 'Time spent in credit bureau calls.', ('endpoint',))
+workflow_schedule_seconds = Histogram(
+    'workflow_schedule_duration_seconds', 'Time spent scheduling a loan broker workflow.')
+
+bank_registry = load_bank_registry()
+quote_banks = [bank.model_dump() for bank in enabled_banks(bank_registry)]
+bank_capabilities = CapabilityCache(quote_banks, capabilities_refresh_seconds, capabilities_retry_seconds)
+
+if quote_scorer not in scorers:
+    raise ValueError('QUOTE_SCORER must be one of %s, got %s' % (', '.join(scorers), quote_scorer))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one workflow client (and gRPC channel) is shared by every request
+    app.state.workflow_client = AioDaprWorkflowClient()
+    request_index.start()
+    bank_capabilities.start()
+    yield
+    bank_capabilities.close(timeout=5)
+    await request_index.close()
+    await async_client.aclose()
+    quote_publisher.close(timeout=10)
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+quote_publisher.start()
 
 workflow_runtime = WorkflowRuntime()
 workflow_runtime.register_workflow(loan_broker_workflow)
-workflow_runtime.register_activity(union_vault_quote)
-workflow_runtime.register_activity(titanium_trust_quote)
-workflow_runtime.register_activity(riverstone_bank_quote)
+workflow_runtime.register_activity(bank_quote)
 workflow_runtime.register_activity(process_results)
 workflow_runtime.register_activity(error_handler)
 workflow_runtime.start()
 
-@app.post('/loan-request')
-def request_loan_workflow(loan_request: LoanRequest):
-    try:
-        with DaprClient() as d:
-            headers = {'dapr-app-id': credit_bureau_appid, 'dapr-api-token': dapr_api_token, 'content-type': 'application/json'}
-            
-            # Send request to retrieve credit score
-            logging.info(f'credit bureau request: {loan_request.model_dump()}')
-
-            credit_bureau = CreditRequest(request_id=loan_request.id, SSN=loan_request.SSN)
-            
-            result = requests.post(
+@app.get('/stats/publisher')
+def publisher_stats():
+    return quote_publisher.stats()
+
+@app.get('/stats/hedging')
+def hedging_stats():
+    return hedgers.stats()
+
+@app.get('/stats/banks')
+def bank_stats():
+    return bank_breakers.stats()
+
+@app.get('/stats/capabilities')
+def capabilities_stats():
+    return bank_capabilities.stats()
+
+@app.get('/stats/request-index')
+def request_index_stats():
+    return request_index.stats()
+
+@app.get('/metrics')
+def metrics():
+    return Response(content=render_metrics(), media_type=metrics_content_type)
+
+async def fetch_credit_score(loan_request: LoanRequest) -> dict:
+    headers = {'dapr-app-id': credit_bureau_appid, 'dapr-api-token': dapr_api_token, 'content-type': 'application/json'}
+
+    # Send request to retrieve credit score
+    logging.info('credit bureau request for loan request %s', loan_request.id, extra=SAMPLED)
+
+    credit_bureau = CreditRequest(request_id=loan_request.id, SSN=loan_request.SSN)
+
+    with credit_bureau_seconds.time('credit-score'), \
+            span('credit-bureau', kind=SPAN_KIND_CLIENT, attributes={'loan.request_id': loan_request.id}):
+        inject(headers)
+        result = await hedgers.get(credit_bureau_appid).call_async(
+            lambda: post_json_async(
                 url='%s/credit-score' % dapr_http_endpoint,
-                json=credit_bureau.model_dump(),
+                payload=credit_bureau.model_dump(),
                 headers=headers
-            )
-            if result.ok:
-                
-                logging.info('Credit score retrieved from credit bureau with status code: %s' % result.status_code)
-
-                credit_score = result.json()
-                logging.info("Credit score is {}".format(credit_score['body']['score']))
-
-                # Start workflow
-
-                start_workflow = d.start_workflow(
-                    workflow_name='loan_broker_workflow',
-                    input={
-                        "request_id": loan_request.id,
-                        "amount": loan_request.amount,
-                        "term":loan_request.term,
-                        "score": credit_score['body']['score']
-                    },
-                    workflow_component="dapr"
+            ),
+            acceptable=lambda response: response.status_code < 500)
+    if not result.is_success:
+        logging.error('Error occurred while invoking App ID %s: %s', credit_bureau_appid, result.reason_phrase)
+        raise HTTPException(status_code=502, detail=result.reason_phrase)
+
+    logging.info('Credit score retrieved from credit bureau with status code: %s', result.status_code, extra=SAMPLED)
+
+    credit_score = result.json()
+    if credit_score['statusCode'] != 200:
+        raise HTTPException(status_code=credit_score['statusCode'], detail='Credit bureau rejected the request')
+
+    # only the score and history are cached, the SSN is dropped from the bureau response
+    return {
+        'score': credit_score['body']['score'],
+        'history': credit_score['body']['history']
+    }
+
+
+async def fetch_credit_scores(ssns: List[str]) -> dict:
+    headers = {'dapr-app-id': credit_bureau_appid, 'dapr-api-token': dapr_api_token, 'content-type': 'application/json'}
+
+    semaphore = asyncio.Semaphore(bulk_bureau_concurrency)
+
+    async def fetch_chunk(chunk: List[str]) -> dict:
+        async with semaphore:
+            with credit_bureau_seconds.time('credit-scores'), \
+                    span('credit-bureau', kind=SPAN_KIND_CLIENT, attributes={'credit.applicants': len(chunk)}):
+                result = await post_json_async(
+                    url='%s/credit-scores' % dapr_http_endpoint,
+                    payload={'requests': [{'request_id': str(index), 'SSN': ssn} for index, ssn in enumerate(chunk)]},
+                    headers=inject(dict(headers))
                 )
+        if not result.is_success:
+            logging.error('Error occurred while invoking App ID %s: %s', credit_bureau_appid, result.reason_phrase)
+            raise HTTPException(status_code=502, detail=result.reason_phrase)
+
+        scores = {}
+        for ssn, credit_score in zip(chunk, result.json()['results']):
+            if credit_score['statusCode'] == 200:
+                scores[ssn] = {
+                    'score': credit_score['body']['score'],
+                    'history': credit_score['body']['history']
+                }
+                credit_score_cache.put(ssn, scores[ssn])
+        return scores
+
+    chunks = [ssns[start:start + bulk_bureau_chunk_size] for start in range(0, len(ssns), bulk_bureau_chunk_size)]
+    scores = {}
+    for chunk_scores in await asyncio.gather(*[fetch_chunk(chunk) for chunk in chunks]):
+        scores.update(chunk_scores)
+
+    logging.info('Resolved %d credit scores in %d bureau calls', len(scores), len(chunks))
+    return scores
+
+
+def parse_loan_requests(body: bytes, content_type: str) -> (List[LoanRequest], List[dict]):
+    # a JSON array or one LoanRequest per line (NDJSON), invalid items are reported by their index
+    errors = []
+    unparsed = set()  # NDJSON lines that are not JSON, already reported
+    if 'ndjson' in content_type:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as err:
+                errors.append({'index': len(items), 'error': 'Invalid JSON: %s' % err})
+                unparsed.add(len(items))
+                items.append(None)
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail='Invalid JSON: %s' % err)
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail='Expected a JSON array of loan requests')
+
+    loan_requests = [None] * len(items)
+    for index, item in enumerate(items):
+        if index in unparsed:
+            continue
+        try:
+            loan_requests[index] = LoanRequest.model_validate(item)
+        except ValidationError as err:
+            errors.append({'index': index, 'error': err.errors(include_url=False)})
+
+    return loan_requests, errors
+
+
+def workflow_input(loan_request: LoanRequest, credit_score: dict) -> dict:
+    # banks whose rules exclude the applicant are decided here, the workflow itself must stay deterministic
+    banks, pre_denied = bank_capabilities.split(quote_banks, loan_request.amount, credit_score['score'])
+    # the activities continue the trace of the request that scheduled the workflow
+    return {
+        "request_id": loan_request.id,
+        "amount": loan_request.amount,
+        "term": loan_request.term,
+        "score": credit_score['score'],
+        "banks": banks,
+        "pre_denied": pre_denied,
+        "max_in_flight": max_in_flight_quotes,
+        "quorum": quote_quorum,
+        "deadline_seconds": quote_deadline_seconds,
+        "scorer": quote_scorer,
+        "traceparent": current_traceparent()
+    }
+
+
+def already_exists(err: grpc.RpcError) -> bool:
+    return isinstance(err, grpc.Call) and err.code() == grpc.StatusCode.ALREADY_EXISTS
+
+
+async def existing_workflow(request_id: str, instance_id: str) -> Optional[dict]:
+    # None once the instance was purged, the request is then scheduled again
+    state = await app.state.workflow_client.get_workflow_state(instance_id, fetch_payloads=False)
+    if state is None:
+        return None
+    logging.info('Loan request %s was submitted again, workflow %s is %s',
+                 request_id, instance_id, state.runtime_status.name)
+    return {
+        'request_id': request_id,
+        'instance_id': instance_id,
+        'runtime_status': state.runtime_status.name,
+        'status': 'duplicate'
+    }
+
+
+async def find_existing_workflows(request_ids: List[str]) -> Dict[str, dict]:
+    """The workflows already started for any of the request ids. Request ids whose instance was purged are
+    forgotten, so they are scheduled again."""
+    known = await request_index.lookup(request_ids)
+    semaphore = asyncio.Semaphore(bulk_schedule_concurrency)
+
+    async def find(request_id: str, instance_id: str) -> Tuple[str, Optional[dict]]:
+        async with semaphore:
+            existing = await existing_workflow(request_id, instance_id)
+        if existing is None:
+            request_index.forget(request_id)
+        return request_id, existing
 
+    found = await asyncio.gather(*[find(request_id, instance_id) for request_id, instance_id in known.items()])
+    return {request_id: existing for request_id, existing in found if existing is not None}
+
+
+async def schedule_workflow(loan_request: LoanRequest, credit_score: dict) -> dict:
+    """Starts the workflow of a loan request, or returns the one a concurrent submission of it started first.
+    Started workflows still have to be recorded in the request index."""
+    wf_input = workflow_input(loan_request, credit_score)
+    try:
+        with workflow_schedule_seconds.time(), span('schedule-workflow'):
+            instance_id = await app.state.workflow_client.schedule_new_workflow(
+                workflow=loan_broker_workflow,
+                input=wf_input,
+                instance_id=loan_request.id
+            )
+    except grpc.RpcError as err:
+        if not already_exists(err):
+            raise
+        existing = await existing_workflow(loan_request.id, loan_request.id)
+        if existing is None:
+            raise
+        return existing
+
+    logging.info('Scheduled loan broker workflow %s for request %s', instance_id, loan_request.id, extra=SAMPLED)
+    return {
+        'request_id': loan_request.id,
+        'instance_id': instance_id,
+        'status': 'scheduled'
+    }
+
+
+@app.get('/credit-cache/stats')
+def credit_cache_stats():
+    return credit_score_cache.stats()
+
+
+@app.post('/loan-request', status_code=202)
+async def request_loan_workflow(loan_request: LoanRequest, response: Response):
+    current_span.get().set_attribute('loan.request_id', loan_request.id)
+    try:
+        # a retried request gets the workflow it started before, with its current status
+        result = (await find_existing_workflows([loan_request.id])).get(loan_request.id)
+        if result is None:
+            credit_score = await credit_score_cache.get_or_load(loan_request.SSN,
+                                                                lambda: fetch_credit_score(loan_request))
+            logging.debug('Credit score is %s', credit_score['score'])
+
+            # Start workflow
+            result = await schedule_workflow(loan_request, credit_score)
+            if result['status'] == 'scheduled':
+                await request_index.record({loan_request.id: result['instance_id']})
+
+        if result['status'] == 'duplicate':
+            request_index.count_duplicates()
+            response.status_code = 200
+        return result
+
+    except grpc.RpcError as err:
+        logger.error('An error occured: %s', err)
+        raise HTTPException(status_code=500, detail=str(err))
+    except httpx.HTTPError as err:
+        logger.error('Credit bureau request failed: %s', err)
+        raise HTTPException(status_code=504, detail=str(err))
+
+
+@app.get('/loan-request/{instance_id}')
+async def loan_request_status(instance_id: str):
+    try:
+        state = await app.state.workflow_client.get_workflow_state(instance_id, fetch_payloads=True)
     except grpc.RpcError as err:
-        logger.error(f"An error occured: {err}")
+        logger.error('An error occured: %s', err)
         raise HTTPException(status_code=500, detail=str(err))
+
+    if state is None:
+        raise HTTPException(status_code=404, detail='Workflow instance %s not found' % instance_id)
+
+    return {
+        'instance_id': instance_id,
+        'runtime_status': state.runtime_status.name,
+        'created_at': state.created_at,
+        'last_updated_at': state.last_updated_at,
+        'quotes': json.loads(state.serialized_output) if state.serialized_output else None,
+        'error': state.failure_details.message if state.failure_details else None
+    }
+
+
+@app.post('/loan-requests', status_code=202)
+async def request_loan_workflows(request: Request):
+    loan_requests, errors = parse_loan_requests(await request.body(), request.headers.get('content-type', ''))
+    results = [None] * len(loan_requests)
+    for error in errors:
+        results[error['index']] = error
+
+    # requests submitted before get the workflow already started for them, like a single submission
+    try:
+        existing = await find_existing_workflows(
+            list(dict.fromkeys(loan_request.id for loan_request in loan_requests if loan_request is not None)))
+    except grpc.RpcError as err:
+        logger.error('An error occured: %s', err)
+        raise HTTPException(status_code=500, detail=str(err))
+
+    # a request repeated within the batch is answered once the first one is scheduled
+    first_index = {}
+    repeats = []
+    for index, loan_request in enumerate(loan_requests):
+        if loan_request is None:
+            continue
+        if loan_request.id in existing:
+            results[index] = {'index': index, **existing[loan_request.id]}
+        elif loan_request.id in first_index:
+            repeats.append((index, loan_request.id))
+        else:
+            first_index[loan_request.id] = index
+            continue
+        loan_requests[index] = None
+
+    # resolve every distinct SSN once, from the cache where possible and in batched bureau calls otherwise
+    credit_scores = {}
+    for loan_request in loan_requests:
+        if loan_request is not None and loan_request.SSN not in credit_scores:
+            credit_scores[loan_request.SSN] = credit_score_cache.get(loan_request.SSN)
+
+    try:
+        misses = [ssn for ssn, credit_score in credit_scores.items() if credit_score is None]
+        if misses:
+            credit_scores.update(await fetch_credit_scores(misses))
+    except httpx.HTTPError as err:
+        logger.error('Credit bureau request failed: %s', err)
+        raise HTTPException(status_code=504, detail=str(err))
+
+    semaphore = asyncio.Semaphore(bulk_schedule_concurrency)
+
+    async def schedule(index: int, loan_request: LoanRequest, credit_score: dict):
+        async with semaphore:
+            try:
+                # every request of the batch gets its own span, so its workflow can be found by request id
+                with span('loan-request', attributes={'loan.request_id': loan_request.id}):
+                    results[index] = {'index': index, **await schedule_workflow(loan_request, credit_score)}
+            except grpc.RpcError as err:
+                logger.error('An error occured: %s', err)
+                results[index] = {'index': index, 'request_id': loan_request.id, 'error': str(err)}
+
+    scheduled = []
+    for index, loan_request in enumerate(loan_requests):
+        if loan_request is None:
+            continue
+        credit_score = credit_scores.get(loan_request.SSN)
+        if credit_score is None:
+            results[index] = {'index': index, 'request_id': loan_request.id, 'error': 'Credit bureau rejected the request'}
+        else:
+            scheduled.append(schedule(index, loan_request, credit_score))
+
+    await asyncio.gather(*scheduled)
+    await request_index.record({result['request_id']: result['instance_id'] for result in results
+                                if result is not None and result.get('status') == 'scheduled'})
+
+    async def answer_repeat(index: int, request_id: str):
+        first = results[first_index[request_id]]
+        if 'instance_id' not in first:
+            results[index] = {**first, 'index': index}
+            return
+        async with semaphore:
+            try:
+                repeat = await existing_workflow(request_id, first['instance_id'])
+            except grpc.RpcError as err:
+                logger.error('An error occured: %s', err)
+                repeat = None
+        # the instance was just started, it is only missing when its status could not be read
+        results[index] = {'index': index, **(repeat or {'request_id': request_id,
+                                                        'instance_id': first['instance_id'],
+                                                        'status': 'duplicate'})}
+
+    await asyncio.gather(*[answer_repeat(index, request_id) for index, request_id in repeats])
+
+    accepted = sum(1 for result in results if result.get('status') == 'scheduled')
+    duplicates = sum(1 for result in results if result.get('status') == 'duplicate')
+    if duplicates:
+        request_index.count_duplicates(duplicates)
+    logging.info('Bulk submission of %d loan requests, %d workflows scheduled, %d duplicates',
+                 len(results), accepted, duplicates)
+
+    return {
+        'accepted': accepted,
+        'duplicates': duplicates,
+        'rejected': len(results) - accepted - duplicates,
+        'results': results
+    }
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -9,3 +11,11 @@ class BankLoanRequest(BaseModel):
     amount: int  # loan amount
     term: int  # the number of months until the loan has to be paid off
     credit: Credit
+
+
+class BankProfile(BaseModel):
+    app_id: str  # Dapr app id the quote request is invoked on
+    path: str = '/loan-quote'  # endpoint path on the bank app
+    weight: int = 1  # banks with a higher weight are asked first
+    enabled: bool = True  # disabled banks are skipped by the fan-out
+    capabilities_path: Optional[str] = None  # eligibility rules, next to path (e.g. /capabilities) when not set
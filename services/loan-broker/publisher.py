@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import grpc
+from dapr.conf import settings
+from dapr.conf.helpers import GrpcEndpoint
+from dapr.proto import api_service_v1, api_v1
+
+'''
+    Long-lived publisher for quote-aggregate events. Events from concurrently finishing workflows are coalesced
+    and sent with one bulk publish call over a single gRPC channel to the sidecar. A batch goes out once
+    PUBLISH_MAX_BATCH_SIZE events are queued or the oldest one waited PUBLISH_MAX_LINGER_MS.
+
+    Each caller waits for the outcome of its own event. When the broker rejects only part of a batch, the
+    response cannot be mapped back to individual events, so the events of that batch are published again one
+    by one. A duplicate is harmless because the aggregator stores aggregates by request id.
+
+    Every event carries its own publish metadata (CloudEvent type and traceparent). DaprClient.publish_events only
+    takes metadata for the whole request, so batches are sent with the generated Dapr stub, which carries
+    metadata per entry. The channel is configured like the one of DaprClient, from DAPR_GRPC_ENDPOINT (or
+    DAPR_RUNTIME_HOST and DAPR_GRPC_PORT) and DAPR_API_TOKEN.
+'''
+
+publish_max_batch_size = int(os.getenv('PUBLISH_MAX_BATCH_SIZE', '100'))
+publish_max_linger_ms = float(os.getenv('PUBLISH_MAX_LINGER_MS', '10'))
+publish_timeout_seconds = float(os.getenv('PUBLISH_TIMEOUT_SECONDS', '30'))
+
+
+def open_channel() -> grpc.Channel:
+    endpoint = GrpcEndpoint(settings.DAPR_GRPC_ENDPOINT or
+                            '%s:%s' % (settings.DAPR_RUNTIME_HOST, settings.DAPR_GRPC_PORT))
+    if endpoint.tls:
+        return grpc.secure_channel(endpoint.endpoint, grpc.ssl_channel_credentials())
+    return grpc.insecure_channel(endpoint.endpoint)
+
+
+class BulkPublisher:
+
+    def __init__(self, pubsub_name: str, topic_name: str, max_batch_size: int, max_linger_ms: float):
+        self.pubsub_name = pubsub_name
+        self.topic_name = topic_name
+        self.max_batch_size = max_batch_size
+        self.linger_seconds = max_linger_ms / 1000.0
+        self.batches = 0
+        self.published = 0
+        self.failed = 0
+        self.fallbacks = 0
+        self._pending = []  # (data, content_type, metadata, Future)
+        self._oldest = None
+        self._closing = False
+        self._channel: Optional[grpc.Channel] = None
+        self._stub: Optional[api_service_v1.DaprStub] = None
+        self._call_metadata = (('dapr-api-token', settings.DAPR_API_TOKEN),) if settings.DAPR_API_TOKEN else ()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='quote-publisher', daemon=True)
+
+    def start(self):
+        self._channel = open_channel()
+        self._stub = api_service_v1.DaprStub(self._channel)
+        self._thread.start()
+
+    def close(self, timeout: Optional[float] = None):
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        if self._channel is not None:
+            self._channel.close()
+
+    def publish(self, data: bytes, content_type: str, metadata: Optional[Dict[str, str]] = None,
+                timeout: float = publish_timeout_seconds):
+        """Queues the event and blocks until it was published, raising if publishing failed."""
+        future = Future()
+        with self._condition:
+            if self._closing:
+                raise RuntimeError('Publisher is closed')
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((data, content_type, metadata or {}, future))
+            # the first event starts the linger timer of the batch, a full batch is sent right away
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch_size:
+                self._condition.notify()
+        future.result(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closing:
+                    if len(self._pending) >= self.max_batch_size:
+                        break
+                    if self._pending:
+                        remaining = self._oldest + self.linger_seconds - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+
+                if self._closing and not self._pending:
+                    return
+
+                batch = self._pending[:self.max_batch_size]
+                self._pending = self._pending[self.max_batch_size:]
+                self._oldest = time.monotonic() if self._pending else None
+
+            # a bulk publish call carries a single content type
+            for content_type in {entry[1] for entry in batch}:
+                self._flush(content_type, [entry for entry in batch if entry[1] == content_type])
+
+    def _flush(self, content_type: str, batch: List[tuple]):
+        with self._condition:
+            self.batches += 1
+
+        try:
+            failed_entries = self._bulk_publish(content_type, batch)
+        except Exception as err:
+            logging.error('Bulk publish of %d events failed: %s', len(batch), err)
+            self._complete(batch, err)
+            return
+
+        if not failed_entries:
+            self._complete(batch, None)
+            return
+
+        logging.warning('%d of %d events rejected by bulk publish, publishing them one by one',
+                        len(failed_entries), len(batch))
+        with self._condition:
+            self.fallbacks += 1
+        for entry in batch:
+            try:
+                self._stub.PublishEvent(api_v1.PublishEventRequest(
+                    pubsub_name=self.pubsub_name,
+                    topic=self.topic_name,
+                    data=entry[0],
+                    data_content_type=content_type,
+                    metadata=entry[2],
+                ), timeout=publish_timeout_seconds, metadata=self._call_metadata)
+                self._complete([entry], None)
+            except Exception as err:
+                self._complete([entry], err)
+
+    def _bulk_publish(self, content_type: str, batch: List[tuple]) -> list:
+        request = api_v1.BulkPublishRequest(
+            pubsub_name=self.pubsub_name,
+            topic=self.topic_name,
+            entries=[api_v1.BulkPublishRequestEntry(entry_id=str(index), event=data, content_type=content_type,
+                                                    metadata=metadata)
+                     for index, (data, _, metadata, _) in enumerate(batch)])
+        try:
+            return self._stub.BulkPublishEvent(request, timeout=publish_timeout_seconds,
+                                               metadata=self._call_metadata).failedEntries
+        except grpc.RpcError as err:
+            # runtimes before the stable bulk publish API only serve the alpha one
+            if err.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            return self._stub.BulkPublishEventAlpha1(request, timeout=publish_timeout_seconds,
+                                                     metadata=self._call_metadata).failedEntries
+
+    def _complete(self, batch: List[tuple], error: Optional[Exception]):
+        with self._condition:
+            if error is None:
+                self.published += len(batch)
+            else:
+                self.failed += len(batch)
+        for _, _, _, future in batch:
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'max_batch_size': self.max_batch_size,
+                'max_linger_ms': self.linger_seconds * 1000.0,
+                'batches': self.batches,
+                'published': self.published,
+                'failed': self.failed,
+                'fallbacks': self.fallbacks
+            }
@@ -0,0 +1,79 @@
+import os
+from typing import Callable, Dict, List
+
+'''
+    Turns the raw bank responses of a workflow into a compact ranked result: the best offer, a sorted
+    shortlist and the ids of the banks that denied, were skipped because the applicant does not meet their
+    eligibility rules (pre-denied), were unavailable (failed, timed out or behind an open circuit
+    breaker) or did not answer before the aggregate was published.
+
+    QUOTE_SCORER - how offers are ranked, one of the names in `scorers` (lowest-rate).
+    QUOTE_SHORTLIST_SIZE - the number of offers kept in the shortlist.
+'''
+
+quote_scorer = os.getenv('QUOTE_SCORER', 'lowest-rate')
+quote_shortlist_size = int(os.getenv('QUOTE_SHORTLIST_SIZE', '5'))
+
+
+def total_cost(rate: float, amount: int, term: int) -> float:
+    # total repaid over the term for a loan with fixed monthly payments at an annual rate in percent
+    if term <= 0:
+        return float(amount)
+    monthly_rate = rate / 100.0 / 12.0
+    if monthly_rate == 0:
+        return float(amount)
+    return amount * monthly_rate / (1 - (1 + monthly_rate) ** -term) * term
+
+
+def lowest_rate(offer: dict) -> float:
+    return offer['rate']
+
+
+scorers: Dict[str, Callable[[dict], float]] = {
+    'lowest-rate': lowest_rate,
+}
+
+
+def rank_quotes(request_id: str, amount: int, term: int, results: List[dict],
+                scorer: str = quote_scorer, shortlist_size: int = quote_shortlist_size) -> dict:
+    if scorer not in scorers:
+        raise ValueError('Unknown quote scorer %s, expected one of %s' % (scorer, ', '.join(scorers)))
+
+    offers = []
+    denied = []
+    pre_denied = []
+    unavailable = []
+    missing = []
+    for result in results:
+        status = result.get('status')
+        if status == 'APPROVED':
+            quote = result['quote']
+            offers.append({
+                'bankId': quote['bankId'],
+                'rate': round(quote['rate'], 4),
+                'total_cost': round(total_cost(quote['rate'], amount, term), 2),
+                'quoteId': quote.get('quoteId'),
+                'expiresAt': quote.get('expiresAt')
+            })
+        elif status == 'DENIED':
+            denied.append(result['bankId'])
+        elif status == 'PRE_DENIED':
+            pre_denied.append(result['bankId'])
+        elif status == 'UNAVAILABLE':
+            unavailable.append(result['bankId'])
+        else:
+            missing.append(result.get('bankId'))
+
+    offers.sort(key=scorers[scorer])
+
+    return {
+        'request_id': request_id,
+        'scorer': scorer,
+        'best_offer': offers[0] if offers else None,
+        'shortlist': offers[:shortlist_size],
+        'approved': len(offers),
+        'denied': denied,
+        'pre_denied': pre_denied,
+        'unavailable': unavailable,
+        'missing': missing
+    }
@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import grpc
+from dapr.aio.clients import DaprClient as AioDaprClient
+from dapr.clients.grpc._state import StateItem
+
+from metrics import Counter
+
+'''
+    Index of the workflow instance started for each loan request id, so a retried submission returns the instance
+    it already started instead of scheduling a second bureau lookup, bank fan-out and aggregate write. Workflows
+    are started with the request id as their instance id, which also makes the workflow engine reject a duplicate
+    of a request that is still running.
+
+    The index is kept in the state store, with a bounded LRU of recently seen request ids in front of it. When the
+    state store cannot be read the request is scheduled, the workflow engine still rejects running duplicates.
+
+    REQUEST_INDEX_STORE - state store component holding the index.
+    REQUEST_INDEX_TTL_SECONDS - how long a request id is remembered in the state store, 0 keeps it forever.
+    REQUEST_INDEX_CACHE_SIZE - the most request ids kept in memory, the least recently used one is dropped first.
+'''
+
+request_index_store = os.getenv('REQUEST_INDEX_STORE', 'kvstore')
+request_index_ttl_seconds = int(os.getenv('REQUEST_INDEX_TTL_SECONDS', '86400'))
+request_index_cache_size = int(os.getenv('REQUEST_INDEX_CACHE_SIZE', '100000'))
+
+KEY_PREFIX = 'loan-request-index:'
+
+duplicate_requests = Counter('duplicate_loan_requests_total',
+                             'Loan request submissions answered with an existing workflow instance.')
+
+
+def index_key(request_id: str) -> str:
+    # the quote aggregates share the store and are keyed by the bare request id
+    return KEY_PREFIX + request_id
+
+
+class RequestIndex:
+
+    def __init__(self, store_name: str, max_size: int, ttl_seconds: int):
+        self.store_name = store_name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.duplicates = 0
+        self.store_errors = 0
+        self.client: Optional[AioDaprClient] = None
+        self._entries = OrderedDict()  # request id -> instance id
+        self._lock = threading.Lock()
+
+    def start(self):
+        # the async client binds its channel to the running event loop
+        self.client = AioDaprClient()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+
+    async def lookup(self, request_ids: List[str]) -> Dict[str, str]:
+        """The instance ids already started for any of the request ids, from memory or else the state store."""
+        found = {}
+        misses = []
+        with self._lock:
+            for request_id in request_ids:
+                instance_id = self._entries.get(request_id)
+                if instance_id is None:
+                    misses.append(request_id)
+                else:
+                    self._entries.move_to_end(request_id)
+                    found[request_id] = instance_id
+            self.hits += len(found)
+            self.misses += len(misses)
+        if not misses:
+            return found
+
+        try:
+            if len(misses) == 1:
+                state = await self.client.get_state(store_name=self.store_name, key=index_key(misses[0]))
+                items = [(misses[0], state.data)]
+            else:
+                states = await self.client.get_bulk_state(store_name=self.store_name,
+                                                          keys=[index_key(request_id) for request_id in misses],
+                                                          parallelism=10)
+                items = [(item.key[len(KEY_PREFIX):], item.data) for item in states.items if not item.error]
+        except grpc.RpcError as err:
+            logging.warning('Could not read the request index, %d requests are scheduled unchecked: %s',
+                            len(misses), err)
+            with self._lock:
+                self.store_errors += 1
+            return found
+
+        stored = {request_id: data.decode('utf-8') for request_id, data in items if data}
+        with self._lock:
+            self.store_hits += len(stored)
+            for request_id, instance_id in stored.items():
+                self._store(request_id, instance_id)
+        found.update(stored)
+        return found
+
+    async def record(self, instances: Dict[str, str]):
+        """Remembers the instance id started for each request id."""
+        if not instances:
+            return
+        with self._lock:
+            for request_id, instance_id in instances.items():
+                self._store(request_id, instance_id)
+
+        metadata = {'ttlInSeconds': str(self.ttl_seconds)} if self.ttl_seconds > 0 else {}
+        try:
+            await self.client.save_bulk_state(
+                store_name=self.store_name,
+                states=[StateItem(key=index_key(request_id), value=instance_id, metadata=metadata)
+                        for request_id, instance_id in instances.items()])
+        except grpc.RpcError as err:
+            # the workflows are running already, only retries served by another replica can start them again
+            logging.warning('Could not record %d requests in the request index: %s', len(instances), err)
+            with self._lock:
+                self.store_errors += 1
+
+    def forget(self, request_id: str):
+        with self._lock:
+            self._entries.pop(request_id, None)
+
+    def count_duplicates(self, amount: int = 1):
+        with self._lock:
+            self.duplicates += amount
+        duplicate_requests.inc(amount=amount)
+
+    def _store(self, request_id: str, instance_id: str):
+        self._entries[request_id] = instance_id
+        self._entries.move_to_end(request_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'duplicates': self.duplicates,
+                'store_errors': self.store_errors
+            }
+
+
+request_index = RequestIndex(request_index_store, request_index_cache_size, request_index_ttl_seconds)
@@ -1,169 +1,225 @@
-import json
 import os
+import time
+from datetime import timedelta
 
 import requests
-from dapr.clients import DaprClient
 
-from fastapi import HTTPException
-import grpc
 import logging
 from typing import List
-from dapr.ext.workflow import DaprWorkflowContext, when_all
+from dapr.ext.workflow import DaprWorkflowContext, when_all, when_any
 
-from model.bank_model import BankLoanRequest, Credit
+from circuit_breaker import bank_breakers
+from event_codec import encode_quote_event, event_content_type, quote_event_metadata
+from hedging import hedgers
+from http_client import post_json
+from log_config import SAMPLED, configure_logging
+from metrics import Histogram
+from publisher import BulkPublisher, publish_max_batch_size, publish_max_linger_ms
+from model.bank_model import BankLoanRequest, BankProfile, Credit
+from ranking import quote_scorer, rank_quotes
+from tracing import SPAN_KIND_CLIENT, SPAN_KIND_PRODUCER, current_traceparent, inject, span
 
-logging.basicConfig(level=logging.INFO)
-
-union_vault_appid = os.getenv('UNION_VAULT_APPID', 'union-vault')
-titanium_trust_appid = os.getenv('TITANIUM_TRUST_APPID', 'titanium-trust')
-riverstone_bank_appid = os.getenv('RIVERSTONE_APPID', 'riverstone-bank')
+configure_logging()
 
 dapr_http_endpoint = os.getenv('DAPR_HTTP_ENDPOINT', 'http://localhost')
 dapr_api_token = os.getenv('DAPR_API_TOKEN', '')
 pubsub_component = os.getenv('PUBSUB_COMPONENT', 'aws-pubsub')
 topic_name = os.getenv('TOPIC_NAME', 'quotes')
 
+quote_publisher = BulkPublisher(pubsub_component, topic_name, publish_max_batch_size, publish_max_linger_ms)
+
+bank_quote_seconds = Histogram(
+    'bank_quote_duration_seconds', 'Time spent in a bank_quote activity.', ('bank', 'status'))
+process_results_seconds = Histogram(
+    'process_results_duration_seconds', 'Time spent ranking and publishing quote aggregates.', ('step',))
+
 
 def error_handler(ctx, error):
-    logging.error(f'Executing error handler: {error}.')
+    logging.error('Executing error handler: %s.', error)
 
     return "error"
 
 
 def loan_broker_workflow(ctx: DaprWorkflowContext, wf_input: {}):
-    logging.info(f'Loan broker workflow started with instance id: {ctx.instance_id}')
-    logging.info(f'Request details: {wf_input}')
+    # the orchestrator runs again for every completed task, only its first run is logged
+    if not ctx.is_replaying:
+        logging.info('Loan broker workflow started with instance id: %s', ctx.instance_id, extra=SAMPLED)
+        logging.debug('Request details: %s', wf_input)
+
+    banks = wf_input['banks']
+    max_in_flight = max(1, wf_input.get('max_in_flight', len(banks)))
+    quorum = wf_input.get('quorum', 0)
+    deadline_seconds = wf_input.get('deadline_seconds', 0)
 
-    # schedule tasks to process the calls to each provider 
+    # schedule tasks to process the calls to each registered bank, never more than max_in_flight at once
     try:
-        loan_broker_results = [ctx.call_activity(riverstone_bank_quote, input=wf_input),
-                          ctx.call_activity(titanium_trust_quote, input=wf_input),
-                          ctx.call_activity(union_vault_quote, input=wf_input)]
-        results = yield when_all(loan_broker_results)
+        results = [None] * len(banks)
+        pending = {}
+        next_bank = 0
+        approved = 0
+
+        # in quorum mode the workflow stops waiting once enough quotes arrived or the deadline fired
+        deadline = ctx.create_timer(timedelta(seconds=deadline_seconds)) if deadline_seconds > 0 else None
+
+        while next_bank < len(banks) or pending:
+            if quorum > 0 and approved >= quorum:
+                break
+
+            while next_bank < len(banks) and len(pending) < max_in_flight:
+                task = ctx.call_activity(bank_quote, input=quote_request(wf_input, banks[next_bank]))
+                pending[task] = next_bank
+                next_bank += 1
+
+            if next_bank == len(banks) and quorum <= 0 and deadline is None:
+                # nothing left to schedule, wait for the remaining banks together
+                remaining = list(pending.keys())
+                for task, result in zip(remaining, (yield when_all(remaining))):
+                    results[pending[task]] = result
+                pending.clear()
+            else:
+                waiting = list(pending.keys()) + ([deadline] if deadline is not None else [])
+                task = yield when_any(waiting)
+                if task is deadline:
+                    logging.info('Quote deadline of %ss reached for request %s', deadline_seconds, wf_input['request_id'])
+                    break
+
+                result = task.get_result()
+                results[pending.pop(task)] = result
+                if result.get('status') == 'APPROVED':
+                    approved += 1
+
+        # banks that did not answer in time, or were never asked, are recorded as missing
+        for index in list(pending.values()) + list(range(next_bank, len(banks))):
+            results[index] = missing_quote(banks[index])
 
         # aggregate the results and send them to another activity
         quote_aggregate = {
             'request_id': wf_input['request_id'],
-            'results': results
+            'amount': wf_input['amount'],
+            'term': wf_input['term'],
+            'scorer': wf_input.get('scorer', quote_scorer),
+            'results': results + wf_input.get('pre_denied', []),
+            'traceparent': wf_input.get('traceparent')
         }
 
-        yield ctx.call_activity(process_results, input=quote_aggregate)
+        ranked_quotes = yield ctx.call_activity(process_results, input=quote_aggregate)
+
+        # the ranked quotes are the workflow output served by GET /loan-request/{instance_id}
+        return ranked_quotes
     
     except Exception as e:
         yield ctx.call_activity(error_handler, input=str(e))
         raise
 
 
-def riverstone_bank_quote(ctx, input: {}):
-    credit = Credit(score=input['score'])
-    loan_req = BankLoanRequest(amount=input['amount'], term=input['term'], credit=credit)
-
-    headers = {'dapr-app-id': riverstone_bank_appid, 'dapr-api-token': dapr_api_token,
-               'content-type': 'application/json'}
-    # request/response
-    try:
-        result = requests.post(
-            url='%s/loan-quote' % dapr_http_endpoint,
-            json=loan_req.model_dump(),
-
-            headers=headers
-        )
-
-        if result.ok:
-            logging.info('Invocation successful with status code: %s' %
-                         result.json())
-            logging.info("Result from riverstone bank is %s" % result.json())
-
-            return result.json()
+def missing_quote(bank: {}) -> {}:
+    return {
+        'status': 'MISSING',
+        'bankId': bank['app_id'],
+        'message': 'No quote received before the aggregate was published'
+    }
 
-        else:
-            logging.error(
-                'Error occurred while invoking App ID: %s' % result.reason)
-            raise HTTPException(status_code=500, detail=result.reason)
 
-    except grpc.RpcError as err:
-        logging.error(f"ErrorCode={err.code()}")
-        raise HTTPException(status_code=500, detail=err.details())
+def quote_request(wf_input: {}, bank: {}) -> {}:
+    return {
+        'request_id': wf_input['request_id'],
+        'amount': wf_input['amount'],
+        'term': wf_input['term'],
+        'score': wf_input['score'],
+        'bank': bank,
+        'traceparent': wf_input.get('traceparent')
+    }
 
 
-def titanium_trust_quote(ctx, input: {}):
+def bank_quote(ctx, input: {}):
+    bank = BankProfile(**input['bank'])
     credit = Credit(score=input['score'])
     loan_req = BankLoanRequest(amount=input['amount'], term=input['term'], credit=credit)
-    headers = {'dapr-app-id': titanium_trust_appid, 'dapr-api-token': dapr_api_token,
-               'content-type': 'application/json'}
-    # request/response
-    try:
-        result = requests.post(
-            url='%s/loan-quote' % dapr_http_endpoint,
-            json=loan_req.model_dump(),
-
-            headers=headers
-        )
-
-        if result.ok:
-            logging.info('Invocation successful with status code: %s' %
-                         result.json())
-            logging.info("Result from titanium trust is %s" % result.json())
-
-            return result.json()
 
-        else:
-            logging.error(
-                'Error occurred while invoking App ID: %s' % result.reason)
-            raise HTTPException(status_code=500, detail=result.reason)
+    # an open breaker answers for the bank right away instead of tying up the activity worker
+    breaker = bank_breakers.get(bank.app_id)
+    if not breaker.allow():
+        bank_quote_seconds.observe(0.0, bank.app_id, 'UNAVAILABLE')
+        return unavailable_quote(bank, 'Circuit breaker is open')
 
-    except grpc.RpcError as err:
-        logging.error(f"ErrorCode={err.code()}")
-        raise HTTPException(status_code=500, detail=err.details())
-
-
-def union_vault_quote(ctx, input: {}):
-    credit = Credit(score=input['score'])
-    loan_req = BankLoanRequest(amount=input['amount'], term=input['term'], credit=credit)
-    headers = {'dapr-app-id': union_vault_appid, 'dapr-api-token': dapr_api_token,
+    headers = {'dapr-app-id': bank.app_id, 'dapr-api-token': dapr_api_token,
                'content-type': 'application/json'}
     # request/response
+    started = time.perf_counter()
+    status = 'UNAVAILABLE'
     try:
-        result = requests.post(
-            url='%s/loan-quote' % dapr_http_endpoint,
-            json=loan_req.model_dump(),
-
-            headers=headers
-        )
-
-        if result.ok:
-            logging.info('Invocation successful with status code: %s' %
-                         result.json())
-            logging.info("Result from union vault is %s" % result.json())
-
-            return result.json()
-
-        else:
-            logging.error(
-                'Error occurred while invoking App ID: %s' % result.reason)
-            raise HTTPException(status_code=500, detail=result.reason)
-
-    except grpc.RpcError as err:
-        logging.error(f"ErrorCode={err.code()}")
-        raise HTTPException(status_code=500, detail=err.details())
+        with span('bank_quote', input.get('traceparent'), SPAN_KIND_CLIENT,
+                  {'loan.request_id': input['request_id'], 'bank': bank.app_id}) as quote_span:
+            timeout = breaker.timeout()
+            payload = loan_req.model_dump()
+            inject(headers)
+            try:
+                # a slow answer is raced by a second request, a server error waits for the other attempt
+                result = hedgers.get(bank.app_id).call(
+                    lambda: post_json(
+                        url='%s%s' % (dapr_http_endpoint, bank.path),
+                        payload=payload,
+                        headers=headers,
+                        read_timeout=timeout
+                    ),
+                    acceptable=lambda response: response.status_code < 500)
+            except requests.Timeout:
+                breaker.record_failure()
+                logging.error('App ID %s did not answer within %.3fs', bank.app_id, timeout)
+                return unavailable_quote(bank, 'No answer within %.3fs' % timeout)
+            except requests.RequestException as err:
+                breaker.record_failure()
+                logging.error('Error occurred while invoking App ID %s: %s', bank.app_id, err)
+                return unavailable_quote(bank, str(err))
+            quote_span.set_attribute('http.response.status_code', result.status_code)
+
+            if result.status_code >= 500:
+                breaker.record_failure()
+                logging.error('Error occurred while invoking App ID %s: %s', bank.app_id, result.reason)
+                return unavailable_quote(bank, 'HTTP %d %s' % (result.status_code, result.reason))
+
+            # the bank answered, even a rejected request does not count against its breaker
+            breaker.record_success(time.perf_counter() - started)
+            if not result.ok:
+                logging.error('App ID %s rejected the quote request: %s', bank.app_id, result.reason)
+                return unavailable_quote(bank, 'HTTP %d %s' % (result.status_code, result.reason))
+
+            quote = result.json()
+            status = quote.get('status', 'UNKNOWN')
+            logging.info('Quote from %s with status %s', bank.app_id, status, extra=SAMPLED)
+            logging.debug('Result from %s is %s', bank.app_id, quote)
+
+            return quote
+    finally:
+        bank_quote_seconds.observe(time.perf_counter() - started, bank.app_id, status)
+
+
+def unavailable_quote(bank: BankProfile, message: str) -> {}:
+    return {
+        'status': 'UNAVAILABLE',
+        'bankId': bank.app_id,
+        'message': message
+    }
 
 
 def process_results(ctx, results: {}):
-    with DaprClient() as d:
-
-        details = {
-            "event_type": "quote-aggregate",
-            "quote_aggregate": json.dumps(results)
-        }
-
-        # push aggregate results as an event to quote-aggregate
-        d.publish_event(
-            pubsub_name=pubsub_component,
-            topic_name=topic_name,
-            data=json.dumps(details),
-            data_content_type='application/json',
-        )
-        
-        logging.info('Published results: %s', json.dumps(results))
-
-        return "success"
+    with span('process_results', results.get('traceparent'), attributes={'loan.request_id': results['request_id']}):
+        # rank the bank responses so the published event only carries the best offer, a shortlist and a summary
+        with process_results_seconds.time('rank'), span('rank'):
+            ranked_quotes = rank_quotes(
+                request_id=results['request_id'],
+                amount=results['amount'],
+                term=results['term'],
+                results=results['results'],
+                scorer=results['scorer']
+            )
+
+        # push aggregate results as an event to quote-aggregate, encoded once and coalesced with other workflows
+        with process_results_seconds.time('publish'), span('publish', kind=SPAN_KIND_PRODUCER):
+            quote_publisher.publish(encode_quote_event(ranked_quotes), event_content_type,
+                                    quote_event_metadata(current_traceparent()))
+
+    logging.info('Published %d ranked offers for request %s', ranked_quotes['approved'], ranked_quotes['request_id'],
+                 extra=SAMPLED)
+
+    return ranked_quotes
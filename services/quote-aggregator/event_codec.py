@@ -0,0 +1,43 @@
+import json
+from typing import Optional, Tuple
+
+import msgpack
+import orjson
+
+'''
+    Decoding of the quote-aggregate events published by the loan broker.
+
+    Version 2 events are the ranked aggregate itself, encoded as compact JSON or msgpack, and their bytes are
+    stored unchanged. The event type, schema version and traceparent travel in the CloudEvent envelope, not in
+    the aggregate. Version 1 events carry the aggregate as a JSON string under quote_aggregate; that string is
+    stored as-is.
+'''
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+
+def decode_quote_event(event) -> Tuple[str, bytes, str, Optional[str]]:
+    """Returns the request id, the bytes to store, their content type and the traceparent of the event."""
+    content_type = event.data_content_type() or JSON_CONTENT_TYPE
+    raw = event.raw_data()
+    traceparent = (event.extensions() or {}).get('traceparent')
+
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return msgpack.unpackb(raw)['request_id'], raw, MSGPACK_CONTENT_TYPE, traceparent
+
+    # the SDK has already parsed JSON payloads, only parse again when it could not
+    payload = event.data() if isinstance(event.data(), dict) else orjson.loads(raw)
+    if 'quote_aggregate' in payload:
+        quote_aggregate = payload['quote_aggregate']
+        return (json.loads(quote_aggregate)['request_id'], quote_aggregate.encode('utf-8'), JSON_CONTENT_TYPE,
+                traceparent)
+
+    return payload['request_id'], raw, JSON_CONTENT_TYPE, traceparent
+
+
+def as_json(value: bytes) -> bytes:
+    # stored aggregates are JSON objects or msgpack maps, which never start with '{'
+    if not value or value[:1] == b'{':
+        return value
+    return orjson.dumps(msgpack.unpackb(value))
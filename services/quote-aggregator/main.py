@@ -1,17 +1,33 @@
 import json
+import msgpack
 import time
 import grpc
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 import logging
 import os
+from typing import Optional, Tuple
 from dapr.clients import DaprClient
-from dapr.clients.grpc._response import TopicEventResponse
+from event_codec import as_json, decode_quote_event
+from log_config import SAMPLED, configure_logging
+from metrics import Counter, Histogram, RequestMetricsMiddleware, metrics_content_type, render_metrics
 from model.cloud_events import CloudEvent
+from quote_cache import QuoteCache, etag_for, quote_cache_size
+from subscriber import QueuedSubscriber, subscriber_workers, subscriber_queue_size
+from tracing import SPAN_KIND_CONSUMER, TracingMiddleware, start_span
+from write_buffer import WriteBehindBuffer, state_flush_max_items, state_flush_interval_ms
 
 statestore_component = os.getenv('QUOTE_AGGREGATE_TABLE', 'kvstore')
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
+
+quote_cache = QuoteCache(quote_cache_size)
+
+event_handling_seconds = Histogram(
+    'quote_event_handling_duration_seconds', 'Time from receiving a quote event to answering it.', ('outcome',))
+state_save_seconds = Histogram(
+    'state_save_duration_seconds', 'Time spent in bulk state saves of quote aggregates.', ('outcome',))
+state_saved_items = Counter('state_saved_items_total', 'Quote aggregates written to the state store.')
 
 # region Declarative subscription
 # app = FastAPI()
@@ -53,54 +69,166 @@ async def lifespan(app: FastAPI):
     shutdown_sub_stream()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
-# Streaming subscription
-def init_sub():
-    with DaprClient() as d:
-        
-        logging.info('Attempting to start subscription...')
+@app.get('/stats/state-writes')
+def state_write_stats():
+    return app.state.write_buffer.stats()
 
-        try:
-            close_fn = d.subscribe_with_handler(
-                    pubsub_name='aws-pubsub', topic='quotes', handler_fn=loan_quotes, dead_letter_topic='undeliverable')
-        
-            app.state.close_fn_handler = close_fn
+@app.get('/stats/subscription')
+def subscription_stats():
+    return app.state.subscriber.stats()
 
-            logging.info('Subscription started...')
+@app.get('/metrics')
+def metrics():
+    return Response(content=render_metrics(), media_type=metrics_content_type)
 
-            while True:
-                time.sleep(1)
-
-        except grpc.RpcError as err:
-                logging.info(f"Error={err}")
-                raise HTTPException(status_code=500, detail=err.details())
+# Streaming subscription
+def init_sub():
+    d = DaprClient()
+    app.state.dapr_client = d
+
+    logging.info('Attempting to start subscription...')
+
+    try:
+        # aggregates are written in batches, each event is acknowledged once its batch is saved
+        write_buffer = WriteBehindBuffer(
+            flush_fn=lambda states: save_states(d, states),
+            max_items=state_flush_max_items,
+            interval_ms=state_flush_interval_ms)
+        write_buffer.start()
+        app.state.write_buffer = write_buffer
+
+        subscription = d.subscribe(
+                pubsub_name='aws-pubsub', topic='quotes', dead_letter_topic='undeliverable')
+
+        # the stream is read in the background and events are handled by a bounded worker pool
+        subscriber = QueuedSubscriber(
+            subscription=subscription,
+            handler_fn=lambda event: loan_quotes(event, subscription, write_buffer),
+            workers=subscriber_workers,
+            queue_size=subscriber_queue_size)
+        subscriber.start()
+        app.state.subscriber = subscriber
+
+        logging.info('Subscription started with %d workers...', subscriber_workers)
+
+    except grpc.RpcError as err:
+            logging.error('Error=%s', err)
+            raise HTTPException(status_code=500, detail=err.details())
 
 def shutdown_sub_stream(): 
     logging.info('Closing subscription...')
-    app.state.close_fn_handler()
-
-def loan_quotes(event):
-    with DaprClient() as d:
-        try:
-            logging.info(f"Received event from {event._source} which was published on {event._pubsub_name} topic {event._topic}")
 
-            quote_aggregate = json.loads(event._data['quote_aggregate'])
+    # drain queued events and buffered writes before the stream is closed, so their acks are delivered
+    app.state.subscriber.stop(timeout=30)
+    app.state.write_buffer.close(timeout=30)
+    app.state.subscriber.close(timeout=5)
+    app.state.dapr_client.close()
+
+    logging.info('Subscription closed')
+
+def save_states(d, states):
+    started = time.perf_counter()
+    try:
+        d.save_bulk_state(store_name=statestore_component, states=states)
+    except Exception:
+        state_save_seconds.observe(time.perf_counter() - started, 'error')
+        raise
+    state_save_seconds.observe(time.perf_counter() - started, 'saved')
+    state_saved_items.inc(amount=len(states))
+
+def loan_quotes(event, subscription, write_buffer):
+    received = time.perf_counter()
+    logging.debug('Received event from %s which was published on %s topic %s', event._source, event._pubsub_name, event._topic)
+
+    try:
+        request_id, value, content_type, traceparent = decode_quote_event(event)
+    except (KeyError, TypeError, ValueError, msgpack.UnpackException) as err:
+        logging.error('Dropping malformed event %s: %s', event._id, err)
+        subscription.respond_drop(event)
+        event_handling_seconds.observe(time.perf_counter() - received, 'dropped')
+        return
+
+    logging.debug('Event contained aggregated quote for request %s', request_id)
+
+    # the span continues the trace of the publishing workflow and ends once the aggregate is saved
+    event_span = start_span('loan_quotes', traceparent, SPAN_KIND_CONSUMER, {'loan.request_id': request_id})
+
+    def on_saved(saved: bool):
+        event_span.end(error=None if saved else 'State save failed')
+        if saved:
+            logging.info('Quote for request %s saved to db %s', request_id, statestore_component, extra=SAMPLED)
+            quote_cache.put(request_id, as_json(value))
+            subscription.respond_success(event)
+        else:
+            subscription.respond_retry(event)
+        event_handling_seconds.observe(time.perf_counter() - received, 'saved' if saved else 'retry')
+
+    # save aggregate data, the event bytes are stored as they arrived
+    write_buffer.add(key=request_id,
+                     value=value,
+                     metadata={"contentType": content_type},
+                     on_done=on_saved)
 
-            logging.info(f"Event contained aggregated quote with details: {quote_aggregate}")
-            
-            # save aggregate data
-            d.save_state(store_name=statestore_component,
-                         key=quote_aggregate["request_id"],
-                         value=json.dumps(quote_aggregate),
-                         state_metadata={"contentType": "application/json"})
-            
-            logging.info(f"Quote successfully saved to db {statestore_component}")
+# endregion
 
-            return TopicEventResponse('success')
+# region Quote read API
+
+def read_quote(request_id: str) -> Optional[Tuple[bytes, str]]:
+    entry = quote_cache.get(request_id)
+    if entry is None:
+        state = app.state.dapr_client.get_state(store_name=statestore_component, key=request_id)
+        if state.data:
+            entry = quote_cache.put(request_id, as_json(state.data))
+    return entry
+
+@app.get('/quotes')
+def get_quotes(ids: str, request: Request):
+    request_ids = [request_id for request_id in ids.split(',') if request_id]
+    entries = {request_id: quote_cache.get(request_id) for request_id in request_ids}
+
+    try:
+        misses = [request_id for request_id, entry in entries.items() if entry is None]
+        if misses:
+            states = app.state.dapr_client.get_bulk_state(store_name=statestore_component, keys=misses, parallelism=10)
+            for item in states.items:
+                if item.data and not item.error:
+                    entries[item.key] = quote_cache.put(item.key, as_json(item.data))
+    except grpc.RpcError as err:
+        logging.error('Error=%s', err)
+        raise HTTPException(status_code=500, detail=err.details())
+
+    etag = etag_for(''.join('%s=%s;' % (request_id, entry[1] if entry else '') for request_id, entry in entries.items()).encode('utf-8'))
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={'ETag': etag})
+
+    # the stored aggregates are already JSON, they are embedded as-is instead of being parsed and re-encoded
+    body = b'{' + b','.join(json.dumps(request_id).encode('utf-8') + b':' + (entry[0] if entry else b'null')
+                            for request_id, entry in entries.items()) + b'}'
+    return Response(content=body, media_type='application/json', headers={'ETag': etag})
+
+@app.get('/quotes/{request_id}')
+def get_quote(request_id: str, request: Request):
+    try:
+        entry = read_quote(request_id)
+    except grpc.RpcError as err:
+        logging.error('Error=%s', err)
+        raise HTTPException(status_code=500, detail=err.details())
+
+    if entry is None:
+        raise HTTPException(status_code=404, detail='No quotes stored for request %s' % request_id)
+
+    value, etag = entry
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={'ETag': etag})
+    return Response(content=value, media_type='application/json', headers={'ETag': etag})
+
+@app.get('/stats/quote-cache')
+def quote_cache_stats():
+    return quote_cache.stats()
 
-        except grpc.RpcError as err:
-            logging.info(f"Error={err}")
-            raise HTTPException(status_code=500, detail=err.details())
 # endregion
 
 if __name__ == "__main__":
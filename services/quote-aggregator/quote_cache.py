@@ -0,0 +1,57 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+'''
+    Bounded LRU cache of stored quote aggregates, so hot request ids are served without a state store round-trip.
+    Entries are added when an aggregate is written and when a read misses. Each entry keeps an ETag derived from
+    the stored bytes, so pollers that send If-None-Match get a 304 without the body.
+
+    QUOTE_CACHE_SIZE - the maximum number of aggregates kept in memory.
+'''
+
+quote_cache_size = int(os.getenv('QUOTE_CACHE_SIZE', '10000'))
+
+
+def etag_for(value: bytes) -> str:
+    return '"%s"' % hashlib.sha1(value).hexdigest()
+
+
+class QuoteCache:
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # request_id -> (value, etag)
+        self._lock = threading.Lock()
+
+    def get(self, request_id: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(request_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(request_id)
+            self.hits += 1
+            return entry
+
+    def put(self, request_id: str, value: bytes) -> Tuple[bytes, str]:
+        entry = (value, etag_for(value))
+        with self._lock:
+            self._entries[request_id] = entry
+            self._entries.move_to_end(request_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
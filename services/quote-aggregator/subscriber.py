@@ -0,0 +1,113 @@
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Optional
+
+from dapr.common.pubsub.subscription import StreamCancelledError, StreamInactiveError
+
+'''
+    Runs a streaming subscription in the background and hands its events to a bounded pool of worker threads.
+
+    SUBSCRIBER_WORKERS - the number of events handled concurrently.
+    SUBSCRIBER_QUEUE_SIZE - the number of received events waiting for a worker. When the queue is full the
+    reader stops pulling from the stream, which pushes back on the sidecar instead of buffering without bound.
+'''
+
+subscriber_workers = int(os.getenv('SUBSCRIBER_WORKERS', str(min(32, (os.cpu_count() or 1) * 4))))
+subscriber_queue_size = int(os.getenv('SUBSCRIBER_QUEUE_SIZE', '1000'))
+
+_STOP = object()
+
+
+class QueuedSubscriber:
+
+    def __init__(self, subscription, handler_fn: Callable, workers: int, queue_size: int):
+        self.subscription = subscription
+        self.handler_fn = handler_fn
+        self.received = 0
+        self.handled = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, name='subscription-reader', daemon=True)
+        self._workers = [threading.Thread(target=self._work, name='subscription-worker-%d' % index, daemon=True)
+                         for index in range(workers)]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        self._reader.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        # let the workers finish every queued event while the stream is still open so their acks go out
+        self._stopping.set()
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout)
+
+        # an event the reader queued behind the stop markers is handed back for redelivery
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            if event is not _STOP:
+                self.subscription.respond_retry(event)
+
+    def close(self, timeout: Optional[float] = None):
+        # closing the stream unblocks the reader waiting on next_message
+        self.subscription.close()
+        self._reader.join(timeout)
+
+    def _read(self):
+        while True:
+            try:
+                event = self.subscription.next_message()
+            except (StreamInactiveError, StreamCancelledError):
+                break
+            except Exception as err:
+                if self._stopping.is_set():
+                    break
+                logging.error('Subscription stream failed: %s', err)
+                continue
+
+            if not event:
+                continue
+            if self._stopping.is_set():
+                # no worker will pick this up anymore, hand it back for redelivery
+                self.subscription.respond_retry(event)
+                continue
+
+            with self._lock:
+                self.received += 1
+            self._queue.put(event)
+
+    def _work(self):
+        while True:
+            event = self._queue.get()
+            if event is _STOP:
+                return
+
+            try:
+                self.handler_fn(event)
+                with self._lock:
+                    self.handled += 1
+            except Exception as err:
+                logging.error('Failed to handle event %s: %s', event.id(), err)
+                with self._lock:
+                    self.failed += 1
+                try:
+                    self.subscription.respond_retry(event)
+                except Exception:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': len(self._workers),
+                'queued': self._queue.qsize(),
+                'queue_size': self._queue.maxsize,
+                'received': self.received,
+                'handled': self.handled,
+                'failed': self.failed
+            }
@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from dapr.clients.grpc._state import StateItem
+
+'''
+    Write-behind buffer for quote aggregates. Items are collected and written with one save_bulk_state call
+    once STATE_FLUSH_MAX_ITEMS are buffered or the oldest item waited STATE_FLUSH_INTERVAL_MS, whichever comes
+    first. Every item carries a callback that learns whether its batch was written, so the subscription only
+    acknowledges an event once its aggregate is durable.
+'''
+
+state_flush_max_items = int(os.getenv('STATE_FLUSH_MAX_ITEMS', '50'))
+state_flush_interval_ms = float(os.getenv('STATE_FLUSH_INTERVAL_MS', '20'))
+
+
+class WriteBehindBuffer:
+
+    def __init__(self, flush_fn: Callable[[List[StateItem]], None], max_items: int, interval_ms: float):
+        self.flush_fn = flush_fn
+        self.max_items = max_items
+        self.interval_seconds = interval_ms / 1000.0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.items_written = 0
+        self.max_flush_size = 0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._pending = []  # (StateItem, on_done)
+        self._oldest = None  # monotonic time the oldest pending item was added
+        self._closing = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='state-write-buffer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, key: str, value, on_done: Callable[[bool], None], metadata: Optional[Dict[str, str]] = None):
+        with self._condition:
+            if self._closing:
+                raise RuntimeError('Write buffer is closed')
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((StateItem(key=key, value=value, metadata=metadata or {}), on_done))
+            # the first item starts the flush interval, a full buffer is written right away
+            if len(self._pending) == 1 or len(self._pending) >= self.max_items:
+                self._condition.notify()
+
+    def close(self, timeout: Optional[float] = None):
+        # stop accepting items and write whatever is still buffered
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closing:
+                    if len(self._pending) >= self.max_items:
+                        break
+                    if self._pending:
+                        remaining = self._oldest + self.interval_seconds - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+
+                if self._closing and not self._pending:
+                    return
+
+                batch = self._pending[:self.max_items]
+                self._pending = self._pending[self.max_items:]
+                self._oldest = time.monotonic() if self._pending else None
+
+            self._flush(batch)
+
+    def _flush(self, batch: List[tuple]):
+        # the same request id can arrive twice within a batch (redelivery), the latest aggregate wins
+        items = list({item.key: item for item, _ in batch}.values())
+
+        started = time.monotonic()
+        try:
+            self.flush_fn(items)
+            succeeded = True
+        except Exception as err:
+            logging.error('Failed to write %d aggregates: %s', len(items), err)
+            succeeded = False
+        elapsed = time.monotonic() - started
+
+        with self._condition:
+            self.flushes += 1
+            if succeeded:
+                self.items_written += len(items)
+            else:
+                self.failed_flushes += 1
+            self.max_flush_size = max(self.max_flush_size, len(items))
+            self.total_flush_seconds += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+        for _, on_done in batch:
+            try:
+                on_done(succeeded)
+            except Exception as err:
+                logging.error('Write buffer callback failed: %s', err)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'max_items': self.max_items,
+                'interval_ms': self.interval_seconds * 1000.0,
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'items_written': self.items_written,
+                'mean_flush_size': self.items_written / (self.flushes - self.failed_flushes) if self.flushes > self.failed_flushes else 0,
+                'max_flush_size': self.max_flush_size,
+                'mean_flush_latency_ms': self.total_flush_seconds * 1000.0 / self.flushes if self.flushes else 0,
+                'max_flush_latency_ms': self.max_flush_seconds * 1000.0
+            }
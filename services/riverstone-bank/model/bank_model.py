@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import List
+
+from pydantic import BaseModel, model_validator
 
 
 class Credit(BaseModel):
@@ -10,3 +12,15 @@ class BankLoanRequest(BaseModel):
     amount: int  # loan amount
     term: int  # the number of months until the loan has to be paid off
     credit: Credit
+
+
+class BankLoanBatchRequest(BaseModel):
+    amounts: List[int]  # loan amount per applicant
+    terms: List[int]  # term in months per applicant
+    scores: List[int]  # credit score per applicant
+
+    @model_validator(mode='after')
+    def check_lengths(self):
+        if not len(self.amounts) == len(self.terms) == len(self.scores):
+            raise ValueError('amounts, terms and scores must have the same length')
+        return self
@@ -1,9 +1,14 @@
 import random
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 
 import logging
-from model.bank_model import BankLoanRequest
+import numpy as np
+from log_config import SAMPLED, configure_logging
+from model.bank_model import BankLoanBatchRequest, BankLoanRequest
+from metrics import RequestMetricsMiddleware, metrics_content_type, render_metrics
+from quote_cache import quote_cache
+from tracing import TracingMiddleware
 
 '''
     Each bank will vary its behavior by the following parameters:
@@ -12,6 +17,9 @@ from model.bank_model import BankLoanRequest
     MAX_LOAN_AMOUNT - the maximum amount the bank is willing to lend to a customer.
     BASE_RATE - the minimum rate the bank might give. The actual rate increases for a lower credit score and some randomness.
     BANK_ID - as the loan broker processes multiple responses, knowing which bank supplied the quote will be handy.
+
+    Approved quotes carry a quoteId and their expiresAt, and are given again for the same profile while they are
+    valid (see quote_cache.py).
 '''
 
 BANK_ID = "titanium-trust"
@@ -19,39 +27,86 @@ MIN_CREDIT_SCORE = 500
 MAX_LOAN_AMOUNT = 700000
 BASE_RATE = 4
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 app = FastAPI()
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+rng = np.random.default_rng()
 
 
 def calculate_interest_rate(amount: int, score: int):
-    if amount <= float(MAX_LOAN_AMOUNT) and score >= float(MIN_CREDIT_SCORE):
+    if amount <= MAX_LOAN_AMOUNT and score >= MIN_CREDIT_SCORE:
         return BASE_RATE + random.random() * ((1000 - score) / 100.0)
 
+
+def calculate_interest_rates(amounts: np.ndarray, scores: np.ndarray):
+    # same rules as calculate_interest_rate, evaluated for every applicant at once
+    eligible = (amounts <= MAX_LOAN_AMOUNT) & (scores >= MIN_CREDIT_SCORE)
+    rates = BASE_RATE + rng.random(len(amounts)) * ((1000 - scores) / 100.0)
+    return eligible, rates
+
 @app.get("/")
 async def root():
     return {"message": "Hello, World!"}
 
+@app.get('/metrics')
+def metrics():
+    return Response(content=render_metrics(), media_type=metrics_content_type)
+
+@app.get('/stats/quote-cache')
+def quote_cache_stats():
+    return quote_cache.stats()
+
+@app.get('/capabilities')
+def capabilities():
+    # the rules of calculate_interest_rate, so the broker can skip applicants this bank would deny anyway
+    return {
+        'bankId': BANK_ID,
+        'min_credit_score': MIN_CREDIT_SCORE,
+        'max_loan_amount': MAX_LOAN_AMOUNT
+    }
+
 @app.post('/loan-quote')
 def bank_loan_request(loanRequest: BankLoanRequest):
-    logging.info(f"Received loan request {loanRequest} for {BANK_ID}")
+    logging.debug('Received loan request %s for %s', loanRequest, BANK_ID)
 
     rate = calculate_interest_rate(loanRequest.amount, loanRequest.credit.score)
 
     if rate:
-        quote = {
-            'rate': rate,
-            'bankId': BANK_ID,
-
-        }
-        logging.info("Titanium Trust Approved Loan Request", quote)
+        # a repeated request for the same profile gets the same quote while it is valid
+        quote = quote_cache.quote(BANK_ID, loanRequest.amount, loanRequest.term, loanRequest.credit.score, rate)
+        logging.info('%s approved loan request with quote %s', BANK_ID, quote, extra=SAMPLED)
         return {
             'status': 'APPROVED',
             'quote': quote
         }
     else:
-        logging.info('Titanium Trust Rejected Loan Request')
+        logging.info('%s rejected loan request', BANK_ID, extra=SAMPLED)
         return {
             'status': 'DENIED',
             'bankId': BANK_ID,
             'message': 'Loan Rejected'
         }
+
+
+@app.post('/loan-quotes')
+def bank_loan_batch_request(batchRequest: BankLoanBatchRequest):
+    eligible, rates = calculate_interest_rates(np.asarray(batchRequest.amounts), np.asarray(batchRequest.scores))
+
+    results = [
+        {
+            'status': 'APPROVED',
+            'quote': quote_cache.quote(BANK_ID, amount, term, score, rate)
+        } if approved else {
+            'status': 'DENIED',
+            'bankId': BANK_ID,
+            'message': 'Loan Rejected'
+        }
+        for approved, rate, amount, term, score in zip(eligible.tolist(), rates.tolist(), batchRequest.amounts,
+                                                       batchRequest.terms, batchRequest.scores)
+    ]
+    logging.info('%s quoted a batch of %d loan requests, %d approved', BANK_ID, len(results), int(eligible.sum()))
+
+    return {
+        'results': results
+    }
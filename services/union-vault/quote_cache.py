@@ -0,0 +1,75 @@
+# Canonical copy in shared/quote_cache.py, vendored into the services by shared/sync.py. Edit it there, not here.
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+'''
+    Quotes issued by the bank, kept for their validity window. A repeated request for the same profile (amount,
+    term and credit score) gets the quote it was already given, with the same rate, quote id and expiry, for as
+    long as that quote is valid. Only a new profile, or one whose quote expired, gets a fresh rate.
+
+    QUOTE_VALIDITY_SECONDS - how long an issued quote is valid.
+    QUOTE_CACHE_SIZE - the most quotes kept, the least recently used one is dropped first.
+'''
+
+quote_validity_seconds = float(os.getenv('QUOTE_VALIDITY_SECONDS', '300'))
+quote_cache_size = int(os.getenv('QUOTE_CACHE_SIZE', '10000'))
+
+
+def format_expiry(expires: float) -> str:
+    return datetime.fromtimestamp(expires, timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+
+
+class QuoteCache:
+
+    def __init__(self, max_items: int, validity_seconds: float):
+        self.max_items = max_items
+        self.validity_seconds = validity_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()  # (bank id, amount, term, score) -> (expires, quote)
+        self._lock = threading.Lock()
+
+    def quote(self, bank_id: str, amount: int, term: int, score: int, rate: float) -> dict:
+        """The valid quote issued earlier for this profile, or a new one at rate."""
+        key = (bank_id, amount, term, score)
+        now = time.time()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[0] > now:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            expires = now + self.validity_seconds
+            quote = {
+                'rate': rate,
+                'bankId': bank_id,
+                'quoteId': uuid.uuid4().hex,
+                'expiresAt': format_expiry(expires)
+            }
+            self._items[key] = (expires, quote)
+            self._items.move_to_end(key)
+            self.misses += 1
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.evictions += 1
+            return quote
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_items': self.max_items,
+                'validity_seconds': self.validity_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+quote_cache = QuoteCache(quote_cache_size, quote_validity_seconds)
@@ -0,0 +1,139 @@
+# Canonical copy in shared/metrics.py, vendored into the services by shared/sync.py. Edit it there, not here.
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence
+
+'''
+    Latency histograms and counters, exposed in the Prometheus text format on GET /metrics. Recording an
+    observation takes one bisect over the bucket bounds and one short lock, so it is cheap enough for every
+    request. Label values are passed positionally, in the order of the metric's label names.
+
+    METRICS_BUCKETS_MS - comma separated upper bounds of the latency buckets in milliseconds.
+'''
+
+metrics_buckets_ms = [float(bound) for bound in
+                      os.getenv('METRICS_BUCKETS_MS', '1,2.5,5,10,25,50,100,250,500,1000,2500,5000,10000').split(',')]
+
+metrics_content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = []
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = ['%s="%s"' % (name, escape_label(str(value))) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        for label_values, value in values:
+            lines.append('%s%s %s' % (self.name, format_labels(self.labelnames, label_values), value))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets_ms: List[float] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.bounds = [bound / 1000.0 for bound in sorted(buckets_ms or metrics_buckets_ms)]
+        self._series: Dict[tuple, list] = {}  # label values -> [bucket counts (last one is +Inf), sum]
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, seconds: float, *label_values):
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.bounds) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.bounds + ['+Inf'], counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name, format_labels(self.labelnames, label_values, 'le="%s"' % bound), cumulative))
+            labels = format_labels(self.labelnames, label_values)
+            lines.append('%s_sum%s %s' % (self.name, labels, total))
+            lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+http_request_seconds = Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ('method', 'route', 'status'))
+
+
+class RequestMetricsMiddleware:
+    """Times every HTTP request by method, route template and status code."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the route template keeps path parameters out of the labels
+            route = scope.get('route')
+            http_request_seconds.observe(time.perf_counter() - started, scope['method'],
+                                         route.path if route is not None else 'unmatched', status[0])
@@ -0,0 +1,63 @@
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+from typing import Dict, List, Tuple
+
+'''
+    Canonical copies of the helper modules every service vendors.
+
+    Each service is deployed from its own directory (the workDir of its app in the dev config) and imports its
+    helpers by plain module name, so shared helpers are copied into the services that use them rather than
+    installed as a package. The copies must not be edited: change the module in this directory and run this
+    script to copy it into every service listed in VENDORED. --check reports copies that differ from the
+    canonical module without changing them, and exits with status 1 when there are any.
+
+    Examples:
+        python shared/sync.py
+        python shared/sync.py --check
+'''
+
+shared_dir = os.path.dirname(os.path.abspath(__file__))
+services_dir = os.path.join(os.path.dirname(shared_dir), 'services')
+
+ALL_SERVICES = ('bank-simulator', 'credit-bureau', 'loan-broker', 'quote-aggregator', 'riverstone-bank',
+                'titanium-trust', 'union-vault')
+BANK_SERVICES = ('bank-simulator', 'riverstone-bank', 'titanium-trust', 'union-vault')
+
+# canonical module -> services that vendor a copy of it
+VENDORED: Dict[str, Tuple[str, ...]] = {
+    'metrics.py': ALL_SERVICES,
+    'log_config.py': ALL_SERVICES,
+    'tracing.py': ALL_SERVICES,
+    # the bank quote cache, quote-aggregator has an unrelated quote_cache.py of its own
+    'quote_cache.py': BANK_SERVICES,
+}
+
+
+def copies() -> List[Tuple[str, str]]:
+    return [(os.path.join(shared_dir, module), os.path.join(services_dir, service, module))
+            for module, services in VENDORED.items() for service in services]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy the shared helper modules into the services.')
+    parser.add_argument('--check', action='store_true', help='only report copies that differ, exit 1 if any do')
+    args = parser.parse_args()
+
+    stale = [(source, target) for source, target in copies()
+             if not os.path.exists(target) or not filecmp.cmp(source, target, shallow=False)]
+    for source, target in stale:
+        if args.check:
+            print('%s differs from %s' % (os.path.relpath(target), os.path.relpath(source)))
+        else:
+            shutil.copyfile(source, target)
+            print('Updated %s' % os.path.relpath(target))
+
+    if args.check and stale:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()